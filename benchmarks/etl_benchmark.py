@@ -0,0 +1,282 @@
+"""Offline end-to-end benchmark of the ETL workflows.
+
+Calls the real task chain of a workflow from workflows.yml in-process, one
+task after the other, against an in-memory Elasticsearch, a fake
+micro_mordred producing synthetic documents and an in-memory publisher. The
+arguments of every task go through the serializer of the celery app first,
+as a worker would receive them, but no broker or worker is involved, so
+queueing is not measured. It reports per stage wall time, Elasticsearch
+requests, serialized message size and time, and peak RSS.
+
+A report saved with --save-baseline gates the next runs: with --baseline the
+benchmark exits with status 1 when a stage or the whole workflow is slower
+than the baseline by more than --max-regression, or sends more Elasticsearch
+requests.
+
+    export DIRECTOR_HOME=/path/to/compass-service-scheduler
+    python benchmarks/etl_benchmark.py --workflow insight.ETL_V1 --docs 2000
+    python benchmarks/etl_benchmark.py --workflow insight.ETL_V1_GROUP --repos 200 --json
+    python benchmarks/etl_benchmark.py --save-baseline baseline.json
+    python benchmarks/etl_benchmark.py --baseline baseline.json --max-regression 0.2
+"""
+import os
+import sys
+import copy
+import json
+import time
+import types
+import argparse
+import resource
+import importlib
+import tempfile
+import configparser
+
+from os.path import abspath, dirname, join
+from datetime import datetime, timedelta
+
+import yaml
+
+from kombu import serialization
+
+from fake_es import FakeElasticsearch
+
+ROOT = abspath(join(dirname(__file__), '..'))
+PACKAGE = 'compass_scheduler'
+METRICS_FLAGS = ['metrics_activity', 'metrics_community', 'metrics_codequality', 'metrics_group_activity']
+
+FAKE_ES = None
+# stages faster than this are compared to it, their timings are mostly noise
+MIN_GATED_SECONDS = 0.05
+
+
+def load_package():
+    """Import the tasks the way director does, as a package named after the repo"""
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = [ROOT]
+    sys.modules[PACKAGE] = package
+    modules = {}
+    for name in ['etl_v1', 'lab_v1', 'custom_v1', 'summary_v1', 'schedu_v1']:
+        try:
+            modules[name] = importlib.import_module(f"{PACKAGE}.tasks.{name}")
+        except ImportError as e:
+            print(f"skip tasks.{name}: {e}", file=sys.stderr)
+    return modules
+
+
+class MemoryPublisher:
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, messages):
+        self.messages.extend(messages)
+
+
+def fake_micro_mordred(fake_es, docs, latency):
+    """Write `docs` synthetic items per backend into the raw then enriched index of the backend"""
+    def micro_mordred(cfg_path, backend_sections, repos_to_check, raw, identities_load, identities_merge, enrich, panels):
+        setup = configparser.ConfigParser(allow_no_value=True)
+        setup.read(cfg_path)
+        with open(setup.get('projects', 'projects_file')) as f:
+            projects = json.load(f)
+        for backend in backend_sections:
+            time.sleep(latency)
+            section = setup[backend]
+            urls = [url for project in projects.values() for url in project.get(backend, project.get(backend.split(':')[0], []))]
+            index = section.get('raw_index') if raw else section.get('enriched_index')
+            if not (raw or enrich) or not index or not urls:
+                continue
+            now = datetime.now()
+            items = [{
+                'uuid': f"{backend}-{i}",
+                'tag': urls[i % len(urls)],
+                'origin': urls[i % len(urls)],
+                'grimoire_creation_date': (now - timedelta(hours=i)).isoformat(),
+                'metadata__updated_on': (now - timedelta(hours=i)).isoformat(),
+                'author_name': f"author-{i % 97}",
+                'state': 'open' if i % 3 else 'closed'
+            } for i in range(docs)]
+            fake_es.index_docs(index, items)
+    return micro_mordred
+
+
+def community_yaml(repos):
+    urls = [f"https://github.com/bench/repo-{i}" for i in range(repos)]
+    return {
+        'community_name': 'bench',
+        'community_org_url': 'https://github.com/bench',
+        'resource_types': {
+            'software-artifact-repositories': {'repo_urls': urls},
+            'governance-repositories': {'repo_urls': []}
+        }
+    }
+
+
+def build_payload(args):
+    payload = {
+        'raw': True,
+        'enrich': True,
+        'identities_load': args.contributors,
+        'identities_merge': False,
+        'panels': False,
+        'debug': False,
+        'refresh_sub_repos': False,
+        'parallel_backends': args.parallel_backends,
+        'sleep_for_waiting': 0
+    }
+    for flag in args.metrics:
+        payload[flag] = True
+    if args.workflow == 'insight.ETL_V1_GROUP':
+        payload['project_template_yaml'] = 'https://raw.githubusercontent.com/bench/bench/main/bench.yml'
+        payload['level'] = 'community'
+    else:
+        payload['project_url'] = 'https://github.com/bench/repo-0'
+        payload['level'] = 'repo'
+    return payload
+
+
+def serialize(celery_task, args, kwargs):
+    """Round trip the arguments of a task through the serializer of the app, as a worker receives them"""
+    content_type, encoding, body = serialization.dumps((args, kwargs), serializer=celery_task.app.conf.task_serializer)
+    args, kwargs = serialization.loads(body, content_type, encoding)
+    return tuple(args), kwargs, len(body)
+
+
+def run_task(celery_task, *args, **kwargs):
+    before = sum(FAKE_ES.requests.values())
+    started = time.perf_counter()
+    args, kwargs, message_bytes = serialize(celery_task, args, kwargs)
+    serialized = time.perf_counter()
+    error = None
+    try:
+        result = celery_task(*args, **kwargs)
+    except Exception as e:
+        result, error = copy.deepcopy(args[0]) if args else None, f"{type(e).__name__}: {e}"
+    return result, {
+        'seconds': round(time.perf_counter() - started, 3),
+        'serialize_seconds': round(serialized - started, 3),
+        'message_bytes': message_bytes,
+        'es_requests': sum(FAKE_ES.requests.values()) - before,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'error': error
+    }
+
+
+def run_workflow(workflow, payload):
+    from director.extensions import cel
+
+    kwargs = {'payload': payload, 'workflow_id': 'benchmark'}
+    report = []
+    params = None
+    for entry in workflow['tasks']:
+        if isinstance(entry, str):
+            args = () if params is None else (params,)
+            params, stats = run_task(cel.tasks[entry], *args, **kwargs)
+            report.append({'task': entry, **stats})
+        else:
+            name = list(entry)[0]
+            results = []
+            for task_name in entry[name]['tasks']:
+                result, stats = run_task(cel.tasks[task_name], copy.deepcopy(params), **kwargs)
+                results.append(result)
+                report.append({'task': task_name, **stats})
+            params = results
+    return report
+
+
+def regressions(report, baseline, max_regression):
+    """Return the stages, and the whole workflow, slower than `baseline` or sending more Elasticsearch requests"""
+    failures = []
+    rows = {row['task']: row for row in baseline['stages']}
+    current = report['stages'] + [{'task': 'total', 'seconds': report['total']['seconds'], 'es_requests': None}]
+    rows['total'] = {'seconds': baseline['total']['seconds'], 'es_requests': None}
+    for row in current:
+        base = rows.get(row['task'])
+        if base is None:
+            continue
+        limit = max(base['seconds'], MIN_GATED_SECONDS) * (1 + max_regression)
+        if row['seconds'] > limit:
+            failures.append(f"{row['task']}: {row['seconds']:.3f}s, baseline {base['seconds']:.3f}s")
+        if row['es_requests'] is not None and row['es_requests'] > base['es_requests']:
+            failures.append(f"{row['task']}: {row['es_requests']} es requests, baseline {base['es_requests']}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workflow', default='insight.ETL_V1')
+    parser.add_argument('--repos', type=int, default=50, help='repositories of the community for ETL_V1_GROUP')
+    parser.add_argument('--docs', type=int, default=1000, help='documents produced per backend')
+    parser.add_argument('--backend-latency', type=float, default=0.0, help='seconds spent by micro_mordred per backend')
+    parser.add_argument('--metrics', nargs='*', default=METRICS_FLAGS, help='metrics_* flags enabled in the payload')
+    parser.add_argument('--contributors', action='store_true', help='run contributors_refresh')
+    parser.add_argument('--parallel-backends', action='store_true')
+    parser.add_argument('--json', action='store_true', help='print the report as json')
+    parser.add_argument('--save-baseline', metavar='PATH', help='write the report to PATH as the baseline')
+    parser.add_argument('--baseline', metavar='PATH', help='fail on a regression against the report saved in PATH')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='slowdown of a stage tolerated against the baseline (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    global FAKE_ES
+    FAKE_ES = FakeElasticsearch().start()
+    workdir = tempfile.mkdtemp(prefix='compass-bench-')
+    os.environ.setdefault('DIRECTOR_HOME', ROOT)
+    os.environ.update({
+        'DIRECTOR_ES_URL': FAKE_ES.url,
+        'DIRECTOR_GRIMOIRELAB_CONFIG_FOLDER': join(workdir, 'analysis_data'),
+        'DIRECTOR_GRIMOIRELAB_CONFIG_TEMPLATE': join(ROOT, 'setup-template.cfg'),
+        'DIRECTOR_METRICS_OUT_INDEX': 'bench_metric_model',
+        'DIRECTOR_METRICS_FROM_DATE': '2000-01-01',
+        'DIRECTOR_RABBITMQ_URI': 'amqp://bench',
+        'DIRECTOR_GITHUB_API_TOKEN': '[]',
+        'DIRECTOR_GITHUB_GRAPHQL_API_TOKEN': '[]',
+    })
+
+    from director import config
+    config.init()
+    modules = load_package()
+    etl_v1 = modules['etl_v1']
+    tools = sys.modules[f"{PACKAGE}.utils.tools"]
+
+    publisher = MemoryPublisher()
+    tools.get_publisher = lambda url_params: publisher
+    tools.load_yaml_template = lambda url: community_yaml(args.repos)
+    etl_v1.micro_mordred = fake_micro_mordred(FAKE_ES, args.docs, args.backend_latency)
+
+    with open(join(ROOT, 'workflows.yml')) as f:
+        workflow = yaml.safe_load(f)[args.workflow]
+
+    started = time.perf_counter()
+    report = run_workflow(workflow, build_payload(args))
+    total = {
+        'workflow': args.workflow,
+        'seconds': round(time.perf_counter() - started, 3),
+        'es_requests': dict(FAKE_ES.requests),
+        'broker_messages': len(publisher.messages),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+    FAKE_ES.stop()
+
+    result = {'stages': report, 'total': total}
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"{'task':<48}{'seconds':>10}{'es req':>9}{'msg KB':>9}{'ser s':>8}{'rss MB':>9}  error")
+        for row in report:
+            print(f"{row['task']:<48}{row['seconds']:>10.3f}{row['es_requests']:>9}{row['message_bytes'] / 1024:>9.1f}"
+                  f"{row['serialize_seconds']:>8.3f}{row['peak_rss_mb']:>9.1f}  {row['error'] or ''}")
+        print(json.dumps(total, indent=2))
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = regressions(result, json.load(f), args.max_regression)
+        for failure in failures:
+            print(f"regression {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""In-process stand-in of the Elasticsearch REST API used by the benchmarks.
+
+Documents are kept in memory per index. Searches return the stored documents
+(queries are not evaluated) and aggregations come back empty but well formed,
+which is enough to drive the scheduler stages and to count the requests they
+send.
+"""
+import gzip
+import json
+import itertools
+import threading
+
+from collections import Counter, defaultdict
+from fnmatch import fnmatch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+def empty_aggregations(aggs):
+    result = {}
+    for name, spec in (aggs or {}).items():
+        kinds = [k for k in spec if k not in ('aggs', 'aggregations', 'meta')]
+        kind = kinds[0] if kinds else 'terms'
+        if kind in ('terms', 'date_histogram', 'histogram', 'range', 'date_range', 'composite', 'significant_terms'):
+            result[name] = {'buckets': []}
+        elif kind in ('top_hits',):
+            result[name] = {'hits': {'total': {'value': 0, 'relation': 'eq'}, 'hits': []}}
+        elif kind in ('stats', 'extended_stats'):
+            result[name] = {'count': 0, 'min': None, 'max': None, 'avg': None, 'sum': 0}
+        elif kind in ('percentiles',):
+            result[name] = {'values': {}}
+        elif kind in ('filter', 'filters', 'nested', 'reverse_nested', 'global'):
+            result[name] = {'doc_count': 0, **empty_aggregations(spec.get('aggs') or spec.get('aggregations'))}
+        else:
+            result[name] = {'value': 0 if kind in ('value_count', 'cardinality', 'sum') else None}
+    return result
+
+
+class FakeElasticsearch:
+    def __init__(self):
+        self.indices = defaultdict(dict)
+        self.scrolls = {}
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                status, resp = fake.dispatch(self.command, self.path, body)
+                data = json.dumps(resp).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('X-Elastic-Product', 'Elasticsearch')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _handle
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+
+    def match_indices(self, pattern):
+        names = set()
+        for part in pattern.split(','):
+            names.update(name for name in self.indices if fnmatch(name, part))
+        return sorted(names)
+
+    def index_docs(self, index, docs):
+        with self.lock:
+            for doc in docs:
+                self.indices[index][doc.get('uuid') or str(next(self.ids))] = doc
+
+    def dispatch(self, method, path, body):
+        uri = urlparse(path)
+        query = {k: v[0] for k, v in parse_qs(uri.query).items()}
+        parts = [p for p in uri.path.split('/') if p]
+        endpoint = next((p for p in reversed(parts) if p.startswith('_')), 'document' if parts else 'info')
+        if parts[:2] == ['_search', 'scroll']:
+            endpoint = 'scroll'
+        with self.lock:
+            self.requests[endpoint] += 1
+        payload = json.loads(body) if body and endpoint != '_bulk' else {}
+
+        if not parts:
+            return 200, {'name': 'fake', 'cluster_name': 'fake', 'version': {'number': '7.10.2', 'build_flavor': 'default'},
+                         'tagline': 'You Know, for Search'}
+        if endpoint == '_bulk':
+            return 200, self.bulk(parts, body)
+        if endpoint == 'scroll':
+            return 200, self.scroll(payload.get('scroll_id') or query.get('scroll_id'), method)
+        if endpoint == '_search':
+            return 200, self.search(parts[0] if parts[0] != '_search' else '*', payload, query)
+        if endpoint == '_count':
+            docs = [d for name in self.match_indices(parts[0]) for d in self.indices[name].values()]
+            return 200, {'count': len(docs)}
+        if endpoint == '_delete_by_query':
+            return 200, {'task': f"fake:{next(self.ids)}"} if query.get('wait_for_completion') == 'false' else \
+                {'deleted': 0, 'failures': []}
+        if endpoint == '_tasks':
+            return 200, {'completed': True, 'response': {'deleted': 0, 'failures': []}}
+        if method == 'HEAD':
+            return (200 if self.match_indices(parts[0]) else 404), {}
+        if method == 'PUT' and len(parts) == 1:
+            self.indices[parts[0]]
+            return 200, {'acknowledged': True, 'index': parts[0]}
+        if method in ('PUT', 'POST') and endpoint in ('_doc', '_create', 'document'):
+            self.index_docs(parts[0], [dict(payload, uuid=parts[-1] if len(parts) > 2 else None)])
+            return 201, {'result': 'created'}
+        if endpoint in ('_mapping', '_mappings', '_settings', '_alias', '_aliases', '_refresh'):
+            return 200, {'acknowledged': True}
+        return 200, {'acknowledged': True}
+
+    def bulk(self, parts, body):
+        lines = [json.loads(line) for line in body.decode('utf-8').splitlines() if line.strip()]
+        items = []
+        for action, source in zip(lines[::2], lines[1::2]):
+            op, meta = next(iter(action.items()))
+            index = meta.get('_index') or parts[0]
+            self.index_docs(index, [dict(source, uuid=meta.get('_id'))])
+            items.append({op: {'_index': index, '_id': meta.get('_id'), 'status': 201}})
+        return {'took': 1, 'errors': False, 'items': items}
+
+    def search(self, pattern, payload, query):
+        docs = [(name, doc) for name in self.match_indices(pattern) for doc in self.indices[name].values()]
+        size = int(query.get('size') or payload.get('size', 10))
+        resp = {
+            'took': 1,
+            'timed_out': False,
+            'hits': {'total': {'value': len(docs), 'relation': 'eq'}, 'hits': [
+                {'_index': name, '_id': doc.get('uuid'), '_source': doc} for name, doc in docs[:size]]},
+            'aggregations': empty_aggregations(payload.get('aggs') or payload.get('aggregations'))
+        }
+        if query.get('scroll'):
+            scroll_id = str(next(self.ids))
+            self.scrolls[scroll_id] = (docs[size:], size)
+            resp['_scroll_id'] = scroll_id
+        return resp
+
+    def scroll(self, scroll_id, method):
+        if method == 'DELETE':
+            self.scrolls.pop(scroll_id, None)
+            return {'succeeded': True}
+        docs, size = self.scrolls.get(scroll_id, ([], 0))
+        self.scrolls[scroll_id] = (docs[size:], size)
+        return {'_scroll_id': scroll_id, 'hits': {'total': {'value': len(docs), 'relation': 'eq'}, 'hits': [
+            {'_index': name, '_id': doc.get('uuid'), '_source': doc} for name, doc in docs[:size]]}}
@@ -0,0 +1,74 @@
+"""Cold start benchmark of the task modules.
+
+Imports the task modules the way a worker does, each run in a fresh
+interpreter, and reports the import time, the peak RSS and the number of
+loaded modules. With --eager every model of utils/model_registry is imported
+as well, which is what a worker paid before the models were loaded lazily.
+
+    export DIRECTOR_HOME=/path/to/compass-service-scheduler
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --eager --runs 5 --json
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+from os.path import abspath, dirname, join
+
+ROOT = abspath(join(dirname(__file__), '..'))
+
+PROBE = """
+import sys, json, time, types, resource, importlib
+started = time.perf_counter()
+from director import config
+config.init()
+package = types.ModuleType('compass_scheduler')
+package.__path__ = [{root!r}]
+sys.modules['compass_scheduler'] = package
+for name in ['etl_v1', 'lab_v1', 'custom_v1', 'summary_v1', 'schedu_v1']:
+    importlib.import_module(f"compass_scheduler.tasks.{{name}}")
+if {eager!r}:
+    registry = sys.modules['compass_scheduler.utils.model_registry']
+    for key in registry.MODELS:
+        registry.load_model(key)
+    from sirmordred.utils.micro import micro_mordred
+print(json.dumps({{
+    'seconds': time.perf_counter() - started,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'modules': len(sys.modules)
+}}))
+"""
+
+
+def probe(eager):
+    output = subprocess.run([sys.executable, '-c', PROBE.format(root=ROOT, eager=eager)],
+                            check=True, capture_output=True, text=True, env=os.environ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--eager', action='store_true', help='also import every registered model')
+    parser.add_argument('--json', action='store_true', help='print the report as json')
+    args = parser.parse_args()
+    os.environ.setdefault('DIRECTOR_HOME', ROOT)
+
+    report = {}
+    for mode in (['lazy', 'eager'] if args.eager else ['lazy']):
+        runs = [probe(mode == 'eager') for _ in range(args.runs)]
+        report[mode] = {key: round(statistics.median(run[key] for run in runs), 3) for key in runs[0]}
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{'mode':<8}{'seconds':>10}{'rss MB':>10}{'modules':>10}")
+    for mode, row in report.items():
+        print(f"{mode:<8}{row['seconds']:>10.3f}{row['rss_mb']:>10.1f}{row['modules']:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,36 @@
-import os
 import logging
-import colorlog
 
-DEBUG_LOG_FORMAT = "[%(asctime)s - %(name)s - %(levelname)s] - %(message)s"
-INFO_LOG_FORMAT = "%(asctime)s %(message)s"
-COLOR_LOG_FORMAT_SUFFIX = "\033[1m %(log_color)s "
-LOG_COLORS = {'DEBUG': 'white', 'INFO': 'cyan', 'WARNING': 'yellow', 'ERROR': 'red', 'CRITICAL': 'red,bg_white'}
+# register the prometheus signal handlers for every queue
+from ..utils import instrumentation
+
+# register the compact result codec on every worker and on the director api
+from director.extensions import cel
+from ..utils import result_codec
+result_codec.install(cel)
+
+# count the elasticsearch requests of every client, the shared one and those of the models
+from ..utils import es_client
+es_client.install()
+
+# cache the elasticsearch reads of every client in redis when QUERY_CACHE_TTL is set
+from ..utils import query_cache
+query_cache.install()
+
+# leave the group tasks disabled by the payload out of the workflows
+from ..utils import workflow_pruning
+workflow_pruning.install()
+
+# keep director from tracking the plain celery subtasks, they have no workflow task row
+from ..utils import director_signals
+director_signals.install()
+
+# log through one queue and one cached file handler per logs dir
+from ..utils import log_manager
 
 def config_logging(debug, logs_dir, append=True):
     """Config logging level output output"""
 
-    if debug:
-        fmt = DEBUG_LOG_FORMAT
-        logging_mode = logging.DEBUG
-    else:
-        fmt = INFO_LOG_FORMAT
-        logging_mode = logging.INFO
-
-    # Setting the color scheme and level into the root logger
-    logging.basicConfig(level=logging_mode)
-    stream = logging.root.handlers[0]
-    formatter = colorlog.ColoredFormatter(fmt=COLOR_LOG_FORMAT_SUFFIX + fmt,
-                                          log_colors=LOG_COLORS)
-    stream.setFormatter(formatter)
-
-    # Creating a file handler and adding it to root
-    if logs_dir:
-        fh_filepath = os.path.join(logs_dir, 'all.log')
-
-        fh = logging.handlers.RotatingFileHandler(fh_filepath, mode=('a+' if append else 'w+'), maxBytes=(50 * 1024 * 1024), backupCount=5)
-        fh.setLevel(logging_mode)
-        formatter = logging.Formatter(fmt)
-        fh.setFormatter(formatter)
-        logging.getLogger().handlers.clear()
-        logging.getLogger().addHandler(stream)
-        logging.getLogger().addHandler(fh)
+    log_manager.use_logs_dir(debug, logs_dir, append)
 
     # ES logger is set to INFO since, it produces a really verbose output if set to DEBUG
     logging.getLogger('elasticsearch').setLevel(logging.WARNING)
@@ -9,11 +9,9 @@ from urllib.parse import urlparse
 from datetime import datetime, timedelta
 from pathlib import Path
 
-from compass_model.base_metrics_model import BaseMetricsModel
-
 from . import config_logging
-from ..utils import tools
-from sirmordred.utils.micro import micro_mordred
+from ..utils import tools, model_registry
+from ..utils.model_registry import micro_mordred
 
 DEFAULT_CONFIG_DIR = 'custom_data'
 CFG_TEMPLATE = 'setup-template.cfg'
@@ -292,7 +290,7 @@ def caculate(*args, **kwargs):
 
         params[f"{data['project_key']}_custom_metrics_started_at"] = datetime.now()
         params[f"{data['project_key']}_custom_metrics_params"] = metrics_cfg
-        custom_model = BaseMetricsModel(**metrics_cfg['params'])
+        custom_model = model_registry.load_model('base')(**metrics_cfg['params'])
         custom_model.metrics_model_metrics(metrics_cfg['url'])
         params[f"{data['project_key']}_custom_metrics_finished_at"] = datetime.now()
     return params
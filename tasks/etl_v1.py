@@ -1,4 +1,7 @@
 from director import task, config
+from director.extensions import cel
+from celery.exceptions import Retry
+from celery.signals import task_failure
 
 import os
 import time
@@ -6,68 +9,34 @@ import json
 import configparser
 import requests
 import urllib.parse
+import logging
 
 from os.path import join, exists, abspath
 from urllib.parse import urlparse
 from datetime import datetime, timedelta
+from dateutil import parser
 from dateutil.relativedelta import relativedelta
 
 from . import config_logging
-from ..utils import tools
-from sirmordred.utils.micro import micro_mordred
+from ..utils import tools, watermarks, fanout, instrumentation
+from ..utils import dedup, params_store, token_pool, routing, shards, query_cache, outbox, tpc_client
+from ..utils import workflow_pruning
+from ..utils.es_client import get_es_client
+# the metrics models and sirmordred are imported by the first task running them
+from ..utils import model_registry
+from ..utils.model_registry import micro_mordred
 
-from elasticsearch import Elasticsearch, RequestsHttpConnection
 
-from compass_metrics_model.metrics_model import (
-    ActivityMetricsModel,
-    CommunitySupportMetricsModel,
-    CodeQualityGuaranteeMetricsModel,
-    OrganizationsActivityMetricsModel
-)
+logger = logging.getLogger(__name__)
 
-# New Metrics Model
-
-from compass_model.contributor.productivity.domain_persona_metrics_model import DomainPersonaMetricsModel
-from compass_model.contributor.productivity.milestone_persona_metrics_model import MilestonePersonaMetricsModel
-from compass_model.contributor.productivity.role_persona_metrics_model import RolePersonaMetricsModel
-from compass_model.software_artifact.robustness.criticality_score_metrics_model import CriticalityScoreMetricsModel 
-from compass_model.software_artifact.robustness.scorecard_metrics_model import ScorecardMetricsModel 
-
-from compass_model_v2.community_health.collaboration_efficiency.collaboration_quality_metrics_model import CollaborationQualityMetricsModel
-from compass_model_v2.community_health.collaboration_efficiency.response_timeliness_metrics_model import  ResponseTimelinessMetricsModel
-
-from compass_model_v2.community_health.community_vitality.community_popularity_metrics_model import CommunityPopularityMetricsModel
-from compass_model_v2.community_health.community_vitality.contribution_activity_metrics_model import ContributionActivityMetricsModel
-from compass_model_v2.community_health.community_vitality.developer_base_metrics_model import DeveloperBaseMetricsModel
-
-from compass_model_v2.community_health.development_governance.organizational_governance_metrics_model import OrganizationalGovernanceMetricsModel
-from compass_model_v2.community_health.development_governance.personal_governance_metrics_model import PersonalGovernanceMetricsModel
-
-from compass_model_v2.developer_journey.developer_attraction.developer_attraction_metrics_model import DeveloperAttractionMetricsModel
-from compass_model_v2.developer_journey.developer_growth.developer_promotion_metrics_model import DeveloperPromotionMetricsModel
-from compass_model_v2.developer_journey.developer_growth.participation_tier_metrics_model import  ParticipationTierMetricsModel
-from compass_model_v2.developer_journey.developer_retention.core_retention_metrics_model import CoreRetentionMetricsModel
-from compass_model_v2.developer_journey.developer_retention.core_loss_metrics_model import CoreLossMetricsModel
-from compass_model_v2.developer_journey.developer_retention.core_churn_metrics_model import CoreChurnMetricsModel
-
-from compass_model_v2.supply_chain_security.dev_and_build.code_review_quality_metrics_model import CodeReviewQualityMetricsModel
-from compass_model_v2.supply_chain_security.dev_and_build.development_document_quality_metrics_model import DevelopmentDocumentQualityMetricsModel
-from compass_model_v2.supply_chain_security.dev_and_build.trusted_build_metrics_model import TrustedBuildMetricsModel
-from compass_model_v2.supply_chain_security.release_and_maintenance.maintenance_management_metrics_model import MaintenanceManagementMetricsModel
-from compass_model_v2.supply_chain_security.release_and_maintenance.release_quality_metrics_model import ReleaseQualityMetricsModel
-from compass_model_v2.supply_chain_security.source_management.legal_compliance_metrics_model import LegalComplianceMetricsModel
-from compass_model_v2.supply_chain_security.source_management.security_management_metrics_model import SecurityManagementMetricsMode
-
-
-
-from compass_contributor.contributor_dev_org_repo import ContributorDevOrgRepo
-from compass_metrics_model.metrics_model_custom import MetricsModelCustom
-
-
-DEFAULT_CONFIG_DIR = 'analysis_data'
 CFG_NAME = 'setup.cfg'
 CFG_TEMPLATE = 'setup-template.cfg'
 JSON_NAME = 'project.json'
+ENRICHED_INDEXES = [
+    'project_git_index', 'project_issues_index', 'project_issues2_index', 'project_pulls_index',
+    'project_pulls2_index', 'project_repo_index', 'project_release_index', 'project_event_index',
+    'project_fork_index', 'project_stargazer_index', 'project_watch_index'
+]
 SUPPORT_DOMAINS = ['gitee.com', 'github.com', 'raw.githubusercontent.com', 'gitcode.com']
 
 
@@ -80,6 +49,15 @@ def validate_callback(callback):
             return True
     return False
 
+def attach_duplicate(params, workflow_id):
+    """Skip every stage when the same stages of the project are already running, see utils.dedup"""
+    if params['dedup'] and workflow_id:
+        owner = dedup.acquire_or_attach(params, str(workflow_id))
+        if owner:
+            logger.info(f"{params['project_hash']} is already running in workflow {owner}, attaching to it")
+            return dedup.as_duplicate(params, owner)
+    return params
+
 # #Repository Example:
 # {
 #     "opencheck_raw":true,
@@ -109,6 +87,10 @@ def validate_callback(callback):
 #       "hook_url": "http://106.13.250.196:3000/api/hook",
 #       "params": {},
 #     },
+#     "incremental": true,
+#     "parallel_backends": false,
+#     "dedup": true,
+#     "fused_metrics": false,
 #     "from-date": "2000-01-01",
 #     "to-date": "2099-01-01",
 # }
@@ -130,6 +112,7 @@ def validate_callback(callback):
 #     "debug":false,
 #     "project_template_yaml":"https://gitee.com/edmondfrank/compass-project-template/raw/main/organizations/EAF.yml",
 #     "level":"community",
+#     "shard_size": 50,
 #     "callback": {
 #       "hook_url": "http://106.13.250.196:3000/api/hook",
 #       "params": {},
@@ -154,7 +137,7 @@ def extract(self, *args, **kwargs):
                     'status': False,
                     'message': message
                 }
-                requests.post(callback['hook_url'], json=callback['params'])
+                queue_callback(callback['hook_url'], callback['params'], self.name, self.request)
         raise Exception(f"no support project from {url}")
 
     params['project_url'] = tools.normalize_url(url)
@@ -210,11 +193,15 @@ def extract(self, *args, **kwargs):
     params['sleep_for_waiting'] = int(payload.get('sleep_for_waiting') or 5)
     params['force_refresh_enriched'] = bool(payload.get('force_refresh_enriched'))
     params['refresh_sub_repos'] = bool(payload.get('refresh_sub_repos')) if payload.get('refresh_sub_repos') != None else True
+    params['incremental'] = bool(payload.get('incremental')) if payload.get('incremental') != None else True
+    params['parallel_backends'] = bool(payload.get('parallel_backends'))
+    params['dedup'] = bool(payload.get('dedup')) if payload.get('dedup') != None else True
+    params['fused_metrics'] = bool(payload.get('fused_metrics'))
     params['from-date'] = payload.get('from-date')
     params['to-date'] = payload.get('to-date')
     params['period'] = payload.get('period')
 
-    return params
+    return attach_duplicate(params, kwargs.get('workflow_id'))
 
 
 @task(name="etl_v1.extract_group", bind=True)
@@ -231,14 +218,13 @@ def extract_group(self, *args, **kwargs):
             if callback['params'].get("callback_type", "") != "tpc_software_callback":
                 callback['params']['password'] = config.get('HOOK_PASS')
                 callback['params']['result'] = {'task': self.name, 'status': False, 'message': message}
-                requests.post(callback['hook_url'], json=callback['params'])
+                queue_callback(callback['hook_url'], callback['params'], self.name, self.request)
         raise Exception(f"no support project from {url}")
 
     project_yaml_url = tools.normalize_url(url)
     params['project_yaml_url'] = project_yaml_url
     params['project_yaml'] = tools.load_yaml_template(project_yaml_url)
     params['project_key'] = params['project_yaml']['community_name']
-    params['project_types'] = params['project_yaml']['resource_types']
     count, gitee_count, github_count, gitcode = tools.count_repos_group(params['project_yaml'])
     data_count = {
         'gitee': gitee_count,
@@ -273,18 +259,40 @@ def extract_group(self, *args, **kwargs):
     params['sleep_for_waiting'] = int(payload.get('sleep_for_waiting') or 5)
     params['force_refresh_enriched'] = bool(payload.get('force_refresh_enriched'))
     params['refresh_sub_repos'] = bool(payload.get('refresh_sub_repos')) if payload.get('refresh_sub_repos') != None else True
+    params['incremental'] = bool(payload.get('incremental')) if payload.get('incremental') != None else True
+    params['parallel_backends'] = bool(payload.get('parallel_backends'))
+    params['dedup'] = bool(payload.get('dedup')) if payload.get('dedup') != None else True
+    params['fused_metrics'] = bool(payload.get('fused_metrics'))
+    params['shard_size'] = int(payload.get('shard_size') or config.get('SHARD_SIZE') or 0)
     params['from-date'] = payload.get('from-date')
     params['to-date'] = payload.get('to-date')
     params['period'] = payload.get('period')
-    return params
+    return attach_duplicate(params, kwargs.get('workflow_id'))
 
 
+@task(name="etl_v1.route")
+def route(*args, **kwargs):
+    """Submit the payload to the size class workflow (small, medium, huge) matching its estimated cost"""
+    payload = kwargs['payload']
+    name, cost = routing.route_workflow(payload)
+    workflow_id = tools.submit_workflow('insight', name, payload)
+    return {'workflow': f"insight.{name}", 'workflow_id': str(workflow_id), 'estimated_seconds': round(cost)}
+
+
+def duplicate_dirs(params, configs_dir, logs_dir, metrics_dir, project_data_path, metrics_data_path):
+    """Point a duplicated run to the dirs of its owner, whose files and log it must not rewrite"""
+    config_logging(params['debug'], logs_dir)
+    params['project_configs_dir'] = configs_dir
+    params['project_logs_dir'] = logs_dir
+    params['project_metrics_dir'] = metrics_dir
+    params['project_data_path'] = project_data_path
+    params['metrics_data_path'] = metrics_data_path
+    return params
+
 @task(name="etl_v1.initialize")
 def initialize(*args, **kwargs):
     params = args[0]
-    root = config.get('GRIMOIRELAB_CONFIG_FOLDER') or DEFAULT_CONFIG_DIR
-
-    configs_dir = abspath(join(root, params['project_hash'][:2], params['project_hash'][2:]))
+    configs_dir = tools.project_configs_dir(params['project_hash'])
     logs_dir = abspath(join(configs_dir, 'logs'))
     metrics_dir = abspath(join(configs_dir, 'metrics'))
 
@@ -292,13 +300,17 @@ def initialize(*args, **kwargs):
         if not exists(directory):
             os.makedirs(directory)
 
+    project_data_path = join(configs_dir, JSON_NAME)
+    metrics_data_path = join(metrics_dir, JSON_NAME)
+    if params.get('duplicate_of'):
+        return duplicate_dirs(params, configs_dir, logs_dir, metrics_dir, project_data_path, metrics_data_path)
+
     project_data = {}
     key = params['project_key']
     url = params['project_url']
     domain_name = params['domain_name']
     project_data = tools.gen_project_section(project_data, domain_name, key, url)
 
-    project_data_path = join(configs_dir, JSON_NAME)
     with open(project_data_path, 'w') as f:
         json.dump(project_data, f, indent=4, sort_keys=True)
 
@@ -306,7 +318,6 @@ def initialize(*args, **kwargs):
     metrics_data[key] = {}
     metrics_data[key][domain_name] = [url]
 
-    metrics_data_path = join(metrics_dir, JSON_NAME)
     with open(metrics_data_path, 'w') as jsonfile:
         json.dump(metrics_data, jsonfile, indent=4, sort_keys=True)
 
@@ -324,9 +335,7 @@ def initialize(*args, **kwargs):
 @task(name="etl_v1.initialize_group")
 def initialize_group(*args, **kwargs):
     params = args[0]
-    root = config.get('GRIMOIRELAB_CONFIG_FOLDER') or DEFAULT_CONFIG_DIR
-
-    configs_dir = abspath(join(root, params['project_hash'][:2], params['project_hash'][2:]))
+    configs_dir = tools.project_configs_dir(params['project_hash'])
     logs_dir = abspath(join(configs_dir, 'logs'))
     metrics_dir = abspath(join(configs_dir, 'metrics'))
 
@@ -334,12 +343,17 @@ def initialize_group(*args, **kwargs):
         if not exists(directory):
             os.makedirs(directory)
 
+    project_data_path = join(configs_dir, JSON_NAME)
+    metrics_data_path = join(metrics_dir, JSON_NAME)
+    if params.get('duplicate_of'):
+        return duplicate_dirs(params, configs_dir, logs_dir, metrics_dir, project_data_path, metrics_data_path)
+
     project_data = {}
     metrics_data = {}
     name = params['project_key']
     domain_name = params['domain_name']
     metrics_data[name] = {}
-    for (project_type, project_info) in params['project_types'].items():
+    for (project_type, project_info) in tools.project_types(params).items():
         suffix = None
         if tools.is_software_artifact_type(project_type):
             suffix = 'software-artifact'
@@ -355,11 +369,9 @@ def initialize_group(*args, **kwargs):
                 key = tools.normalize_key(project_url)
                 project_data = tools.gen_project_section(project_data, domain_name, key, url)
 
-    project_data_path = join(configs_dir, JSON_NAME)
     with open(project_data_path, 'w') as f:
         json.dump(project_data, f, indent=4, sort_keys=True)
 
-    metrics_data_path = join(metrics_dir, JSON_NAME)
     with open(metrics_data_path, 'w') as jsonfile:
         json.dump(metrics_data, jsonfile, indent=4, sort_keys=True)
 
@@ -371,23 +383,25 @@ def initialize_group(*args, **kwargs):
     params['project_metrics_dir'] = metrics_dir
     params['project_data_path'] = project_data_path
 
-    return params
+    # the community yaml is passed by reference to the next tasks
+    return params_store.put(params, 'project_yaml', params['project_yaml'])
 
 
 @task(name="etl_v1.start", autoretry_for=(Exception,), retry_kwargs={'max_retries': 3}, acks_late=True)
 def start(*args, **kwargs):
     params = args[0]
+    if params.get('duplicate_of'):
+        return params
     label = params.get('project_url') or params.get('project_key')
     message = {
         'label': label,
         'level': params['level'],
         'origin': params.get('domain_name'),
         'status': 'progress',
-        'count': 1 if params['level'] == 'repo' else tools.count_repos(params['project_yaml']),
+        'count': 1 if params['level'] == 'repo' else tools.count_repos(params_store.get(params, 'project_yaml')),
         'status_updated_at': datetime.isoformat(datetime.utcnow())
     }
-    tools.basic_publish('subscriptions_update_v1', message, config.get('RABBITMQ_URI'))
-    tools.basic_publish('third_party_callback_v1', message, config.get('RABBITMQ_URI'))
+    tools.basic_publish_many(['subscriptions_update_v1', 'third_party_callback_v1'], message, config.get('RABBITMQ_URI'))
     return params
 
 @task(name="etl_v1.setup")
@@ -700,9 +714,22 @@ def setup(*args, **kwargs):
     else:
         pass
 
+    # resume raw collection of each backend from its last successful run
+    if params.get('incremental') and not params.get('from-date'):
+        repo_urls = sorted(set(tools.project_repo_urls(params)))
+        for backend in backends:
+            from_date = watermarks.get_from_date(params['project_configs_dir'], backend, repo_urls)
+            if from_date:
+                setup[backend]['from-date'] = from_date
+            else:
+                # no watermark yet, this backend collects its full history
+                params['full_collection'] = True
+
     project_setup_path = join(params['project_configs_dir'], CFG_NAME)
-    with open(project_setup_path, 'w') as cfg:
-        setup.write(cfg)
+    # a duplicated run leaves the setup of its owner alone, the owner may be collecting with its leased tokens
+    if not params.get('duplicate_of'):
+        with open(project_setup_path, 'w') as cfg:
+            setup.write(cfg)
 
     params['project_setup_path'] = project_setup_path
     params['project_backends'] = backends
@@ -764,69 +791,200 @@ def setup(*args, **kwargs):
     return params
 
 
-@task(name="etl_v1.raw", autoretry_for=(Exception,), retry_kwargs={'max_retries': 5}, acks_late=True)
-def raw(*args, **kwargs):
-    params = args[0]
-    config_logging(params['debug'], params['project_logs_dir'])
-    params['raw_started_at'] = datetime.now()
-    if params['raw']:
+def collect_backend(setup_path, backend):
+    """Collect the raw data of one backend, on api tokens leased from the pool shared by every worker.
+
+    While the pool holds other tokens with quota left, the collection stops on
+    a rate limit instead of sleeping: the drained tokens are swapped for fresh
+    ones and the backend is collected again. It only sleeps for the rate once
+    the whole pool is drained.
+    """
+    pool = token_pool.backend_pool(backend)
+    drained = set()
+    while True:
+        lease_id, tokens = token_pool.lease(pool, exclude=drained) if pool else (None, [])
+        leased = {token_pool.token_id(token) for token in tokens}
+        spare = bool(lease_id) and token_pool.has_spare(pool, drained | leased)
+        error = None
+        try:
+            if lease_id:
+                token_pool.use_tokens(setup_path, backend, tokens, sleep_for_rate=not spare)
+            try:
+                with instrumentation.time_backend('raw', backend):
+                    micro_mordred(
+                        setup_path,
+                        [backend],
+                        None,
+                        True,
+                        False,
+                        False,
+                        False,
+                        False
+                    )
+            except Exception as e:
+                if not spare:
+                    raise
+                error = e
+            run_drained = token_pool.drained(pool, tokens) if spare else set()
+        finally:
+            if lease_id:
+                token_pool.release(pool, lease_id, tokens)
+        if not spare or run_drained != leased:
+            if error:
+                raise error
+            return
+        drained |= run_drained
+        logger.info(f"Tokens of {backend} drained, collecting again on fresh tokens of {pool}")
+
+def enrich_backend(setup_path, backend):
+    with instrumentation.time_backend('enrich', backend):
         micro_mordred(
-            params['project_setup_path'],
-            params['project_backends'],
+            setup_path,
+            [backend],
             None,
-            params['raw'],
             False,
             False,
             False,
+            True,
             False
         )
+
+def is_sharded(params):
+    return params['level'] == 'community' and bool(params.get('shard_size'))
+
+@cel.task(name="etl_v1.shard", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
+def shard(phase, setup_path, backends, debug, logs_dir, parallel_backends=False):
+    """Run the raw or enrich phase of one batch of repos of a community"""
+    config_logging(debug, logs_dir)
+    run_backend = collect_backend if phase == 'raw' else enrich_backend
+    fanout.run_backends(backends, lambda backend: run_backend(setup_path, backend), parallel_backends)
+    return setup_path
+
+def run_shards(task, params, phase, kwargs):
+    """Run `phase` of a community as one etl_v1.shard subtask per `shard_size` repos, spread over the cluster.
+
+    The stage does not hold its worker slot while the shards run, it polls
+    them every `SHARD_POLL_SECONDS`, at most `SHARD_MAX_POLLS` times, until
+    they all succeeded. Failed shards are submitted again, up to
+    `SHARD_MAX_ATTEMPTS` times each.
+    """
+    state_key = f"{phase}_shards"
+    queue = config.get('SHARD_QUEUE') or (task.request.delivery_info or {}).get('routing_key')
+
+    def submit(setup_path):
+        return shard.apply_async(args=(phase, setup_path, params['project_backends'], params['debug'],
+                                       params['project_logs_dir'], params.get('parallel_backends')), queue=queue).id
+
+    if not params.get(state_key):
+        params[state_key] = [{'setup_path': setup_path, 'task_id': submit(setup_path), 'attempts': 1}
+                             for setup_path in shards.write_shards(params, phase, int(params['shard_size']))]
+
+    max_attempts = int(config.get('SHARD_MAX_ATTEMPTS') or 3)
+    pending = []
+    for entry in params[state_key]:
+        result = cel.AsyncResult(entry['task_id'])
+        if result.successful():
+            continue
+        if result.failed():
+            if entry['attempts'] >= max_attempts:
+                # start over with new shards if the stage itself is retried
+                params.pop(state_key)
+                params.pop(f"{phase}_shard_polls", None)
+                raise Exception(f"{phase} shard {entry['setup_path']} failed {entry['attempts']} times: {result.result}")
+            entry = {**entry, 'task_id': submit(entry['setup_path']), 'attempts': entry['attempts'] + 1}
+        pending.append(entry)
+    if pending:
+        params[state_key] = pending
+        poll_later(task, params, kwargs, f"{phase}_shard_polls",
+                   int(config.get('SHARD_POLL_SECONDS') or 60), int(config.get('SHARD_MAX_POLLS') or 10080))
+    params.pop(state_key)
+    params.pop(f"{phase}_shard_polls", None)
+
+@task(name="etl_v1.raw", bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 5}, acks_late=True)
+def raw(self, *args, **kwargs):
+    params = args[0]
+    config_logging(params['debug'], params['project_logs_dir'])
+    if not params.get('raw_shards'):
+        params['raw_started_at'] = datetime.now()
+        # perceval reads from-date as utc
+        params['raw_watermark_at'] = datetime.utcnow()
+    if params['raw']:
+        # a run bounded by the payload dates did not collect everything up to now
+        advance_watermarks = not params.get('from-date') and not params.get('to-date')
+        if is_sharded(params):
+            run_shards(self, params, 'raw', kwargs)
+            # every shard succeeded, the backends are fully collected since the stage started
+            if advance_watermarks:
+                repo_urls = sorted(set(tools.project_repo_urls(params)))
+                started_at = params['raw_watermark_at']
+                started_at = parser.parse(started_at) if isinstance(started_at, str) else started_at
+                for backend in params['project_backends']:
+                    watermarks.advance(params['project_configs_dir'], backend, started_at, repo_urls)
+        else:
+            repo_urls = sorted(set(tools.project_repo_urls(params))) if advance_watermarks else None
+
+            # collect backends one by one so that only the successful ones advance their watermark
+            def collect(backend):
+                backend_started_at = datetime.utcnow()
+                collect_backend(params['project_setup_path'], backend)
+                if advance_watermarks:
+                    watermarks.advance(params['project_configs_dir'], backend, backend_started_at, repo_urls)
+
+            fanout.run_backends(params['project_backends'], collect, params.get('parallel_backends'))
         params['raw_finished_at'] = datetime.now()
     else:
         params['raw_finished_at'] = 'skipped'
     return params
 
 
-@task(name="etl_v1.expire_enriched", autoretry_for=(Exception,), acks_late=True)
-def expire_enriched(*args, **kwargs):
+def poll_later(task, params, kwargs, poll_key, countdown, max_polls):
+    """Run the task again with `params` in `countdown` seconds, without holding the worker slot.
+
+    Polls are counted in `params[poll_key]`, up to `max_polls`. The request
+    keeps its `retries`, so polling does not use up the retries the task
+    gets on exceptions.
+    """
+    polls = params.get(poll_key, 0) + 1
+    if polls > max_polls:
+        params.pop(poll_key, None)
+        raise Exception(f"{task.name} still waiting after {max_polls} polls")
+    params[poll_key] = polls
+    request = task.request
+    if request.called_directly:
+        raise task.retry(args=(params,), kwargs=kwargs, countdown=countdown)
+    signature = task.signature_from_request(request, (params,), kwargs, countdown=countdown, retries=request.retries)
+    signature.apply_async()
+    raise Retry(f"poll {polls} of {poll_key}", when=countdown, sig=signature)
+
+@task(name="etl_v1.expire_enriched", bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3}, acks_late=True)
+def expire_enriched(self, *args, **kwargs):
     params = args[0]
     config_logging(params['debug'], params['project_logs_dir'])
-    params['force_refresh_enriched_started_at'] = datetime.now()
+    if not params.get('force_refresh_enriched_tasks'):
+        params['force_refresh_enriched_started_at'] = datetime.now()
     if params.get('force_refresh_enriched'):
-        elastic_url = config.get('ES_URL')
-        is_https = urlparse(elastic_url).scheme == 'https'
-        es_client = Elasticsearch(
-            elastic_url, use_ssl=is_https, verify_certs=False, connection_class=RequestsHttpConnection,
-            timeout=180, max_retries=3, retry_on_timeout=True)
-        repo_urls = []
-        if params.get('level') == 'repo':
-            repo_urls = [params['project_url']]
-        else:
-            for (project_type, project_info) in params['project_types'].items():
-                suffix = None
-                if tools.is_software_artifact_type(project_type):
-                    suffix = 'software-artifact'
-                if tools.is_governance_type(project_type):
-                    suffix = 'governance'
-                if suffix:
-                    urls = list(filter(lambda url: tools.url_is_valid(url), project_info['repo_urls']))
-                    repo_urls.extend(urls)
-
-        for repo_url in repo_urls:
-            for index in [
+        es_client = get_es_client()
+        if not params.get('force_refresh_enriched_tasks'):
+            repo_urls = tools.project_repo_urls(params)
+            params['force_refresh_enriched_tasks'] = tools.expire_enriched_tags(es_client, {
+                params[index]: [f"{repo_url}.git" if 'git' in index else repo_url for repo_url in set(repo_urls)]
+                for index in [
                     'project_git_index',
                     'project_issues_index',
                     'project_issues2_index',
                     'project_pulls_index',
                     'project_pulls2_index'
-            ]:
-                body = {
-                    "query": {
-                        "match": {
-                            "tag": f"{repo_url}.git" if 'git' in index else repo_url
-                        }
-                    }
-                }
-                es_client.delete_by_query(index=params[index], body=body)
+                ]
+            })
+
+        # release the worker slot while elasticsearch deletes, enrich must not start before it is done
+        pending_tasks = tools.pending_es_tasks(es_client, params['force_refresh_enriched_tasks'])
+        if pending_tasks:
+            params['force_refresh_enriched_tasks'] = pending_tasks
+            poll_later(self, params, kwargs, 'force_refresh_enriched_polls',
+                       int(config.get('ES_DELETE_POLL_SECONDS') or 30), int(config.get('ES_DELETE_MAX_POLLS') or 2880))
+        params.pop('force_refresh_enriched_tasks')
+        params.pop('force_refresh_enriched_polls', None)
         params['force_refresh_enriched_finished_at'] = datetime.now()
     else:
         params['force_refresh_enriched_finished_at'] = 'skipped'
@@ -834,22 +992,21 @@ def expire_enriched(*args, **kwargs):
     return params
 
 
-@task(name="etl_v1.enrich", autoretry_for=(Exception,), retry_kwargs={'max_retries': 3}, acks_late=True)
-def enrich(*args, **kwargs):
+@task(name="etl_v1.enrich", bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3}, acks_late=True)
+def enrich(self, *args, **kwargs):
     params = args[0]
     config_logging(params['debug'], params['project_logs_dir'])
-    params['enrich_started_at'] = datetime.now()
+    if not params.get('enrich_shards'):
+        params['enrich_started_at'] = datetime.now()
     if params['enrich']:
-        micro_mordred(
-            params['project_setup_path'],
-            params['project_backends'],
-            None,
-            False,
-            False,
-            False,
-            params['enrich'],
-            False
-        )
+        if is_sharded(params):
+            run_shards(self, params, 'enrich', kwargs)
+        else:
+            fanout.run_backends(params['project_backends'],
+                                lambda backend: enrich_backend(params['project_setup_path'], backend),
+                                params.get('parallel_backends'))
+        # micro_mordred does not write through elasticsearch-py, drop the cached reads of what it enriched
+        query_cache.invalidate([params.get(index) for index in ENRICHED_INDEXES])
         params['enrich_finished_at'] = datetime.now()
     else:
         params['enrich_finished_at'] = 'skipped'
@@ -941,8 +1098,8 @@ def contributors_refresh(*args, **kwargs):
             'bots_index': 'bots',
             'company': None
         }
-        params["contributors_refresh_params"] = metrics_cfg
-        contributor_refresh = ContributorDevOrgRepo(**metrics_cfg['params'])
+        params_store.put(params, "contributors_refresh_params", metrics_cfg)
+        contributor_refresh = model_registry.load_model('contributors_refresh')(**metrics_cfg['params'])
         contributor_refresh.run(metrics_cfg['url'])
         params['contributors_refresh_finished_at'] = datetime.now()
     else:
@@ -977,8 +1134,8 @@ def metrics_activity(*args, **kwargs):
             'pr_comments_index': params['project_pulls2_index'],
             'contributors_index': params['project_contributors_index']
         }
-        params['metrics_activity_params'] = metrics_cfg
-        model_activity = ActivityMetricsModel(**metrics_cfg['params'])
+        params_store.put(params, 'metrics_activity_params', metrics_cfg)
+        model_activity = model_registry.load_model('activity')(**metrics_cfg['params'])
         model_activity.metrics_model_metrics(metrics_cfg['url'])
         params['metrics_activity_finished_at'] = datetime.now()
     else:
@@ -1007,8 +1164,8 @@ def metrics_community(*args, **kwargs):
             'community': project_key,
             'level': params['level']
         }
-        params['metrics_community_params'] = metrics_cfg
-        model_community = CommunitySupportMetricsModel(**metrics_cfg['params'])
+        params_store.put(params, 'metrics_community_params', metrics_cfg)
+        model_community = model_registry.load_model('community')(**metrics_cfg['params'])
         model_community.metrics_model_metrics(metrics_cfg['url'])
         params['metrics_community_finished_at'] = datetime.now()
     else:
@@ -1042,8 +1199,8 @@ def metrics_codequality(*args, **kwargs):
             'pr_comments_index': params['project_pulls2_index'],
             'contributors_index': params['project_contributors_index']
         }
-        params['metrics_codequality_params'] = metrics_cfg
-        model_codequality = CodeQualityGuaranteeMetricsModel(**metrics_cfg['params'])
+        params_store.put(params, 'metrics_codequality_params', metrics_cfg)
+        model_codequality = model_registry.load_model('codequality')(**metrics_cfg['params'])
         model_codequality.metrics_model_metrics(metrics_cfg['url'])
         params['metrics_codequality_finished_at'] = datetime.now()
     else:
@@ -1078,8 +1235,8 @@ def metrics_group_activity(*args, **kwargs):
             'pr_comments_index': params['project_pulls2_index'],
             'contributors_index': params['project_contributors_index']
         }
-        params['metrics_group_activity_params'] = metrics_cfg
-        model_codequality = OrganizationsActivityMetricsModel(**metrics_cfg['params'])
+        params_store.put(params, 'metrics_group_activity_params', metrics_cfg)
+        model_codequality = model_registry.load_model('group_activity')(**metrics_cfg['params'])
         model_codequality.metrics_model_metrics(metrics_cfg['url'])
         params['metrics_group_activity_finished_at'] = datetime.now()
     else:
@@ -1095,11 +1252,6 @@ def metrics_domain_persona(*args, **kwargs):
     params['metrics_domain_persona_started_at'] = datetime.now()
 
     if params.get('metrics_domain_persona'):
-        elastic_url = config.get('ES_URL')
-        is_https = urlparse(elastic_url).scheme == 'https'
-        es_client = Elasticsearch(
-            elastic_url, use_ssl=is_https, verify_certs=False, connection_class=RequestsHttpConnection,
-            timeout=180, max_retries=3, retry_on_timeout=True)
         out_index = params['model_domain_persona_index']
         from_date = params.get('from-date') if params.get('from-date') else config.get('METRICS_FROM_DATE')
         end_date = params.get('to-date') if params.get('to-date') else datetime.now().strftime('%Y-%m-%d')
@@ -1123,11 +1275,11 @@ def metrics_domain_persona(*args, **kwargs):
             'json_file': params['metrics_data_path'],
             'contributors_enriched_index': params['project_contributors_enriched_index']
         }
-        params['metrics_domain_persona_params'] = metrics_cfg
-        model_domain_persona = DomainPersonaMetricsModel(**metrics_cfg['params'])
+        params_store.put(params, 'metrics_domain_persona_params', metrics_cfg)
+        model_domain_persona = model_registry.load_model('domain_persona')(**metrics_cfg['params'])
         model_domain_persona.metrics_model_metrics(metrics_cfg['url'])
         if params['level'] == 'community' and params.get('refresh_sub_repos'):
-            tools.check_sub_repos_metrics(es_client, out_index, params['project_types'],
+            tools.check_sub_repos_metrics(out_index, tools.project_types(params),
                                           {'metrics_domain_persona': True, 'from-date': from_date, 'to-date': end_date})
         params['metrics_domain_persona_finished_at'] = datetime.now()
     else:
@@ -1142,11 +1294,6 @@ def metrics_milestone_persona(*args, **kwargs):
     params['metrics_milestone_persona_started_at'] = datetime.now()
 
     if params.get('metrics_milestone_persona'):
-        elastic_url = config.get('ES_URL')
-        is_https = urlparse(elastic_url).scheme == 'https'
-        es_client = Elasticsearch(
-            elastic_url, use_ssl=is_https, verify_certs=False, connection_class=RequestsHttpConnection,
-            timeout=180, max_retries=3, retry_on_timeout=True)
         out_index = params['model_milestone_persona_index']
         from_date = params.get('from-date') if params.get('from-date') else config.get('METRICS_FROM_DATE')
         end_date = params.get('to-date') if params.get('to-date') else datetime.now().strftime('%Y-%m-%d')
@@ -1170,11 +1317,11 @@ def metrics_milestone_persona(*args, **kwargs):
             'json_file': params['metrics_data_path'],
             'contributors_enriched_index': params['project_contributors_enriched_index']
         }
-        params["metrics_milestone_persona_params"] = metrics_cfg
-        model_milestone_persona = MilestonePersonaMetricsModel(**metrics_cfg['params'])
+        params_store.put(params, "metrics_milestone_persona_params", metrics_cfg)
+        model_milestone_persona = model_registry.load_model('milestone_persona')(**metrics_cfg['params'])
         model_milestone_persona.metrics_model_metrics(metrics_cfg['url'])
         if params['level'] == 'community' and params.get('refresh_sub_repos'):
-            tools.check_sub_repos_metrics(es_client, out_index, params['project_types'],
+            tools.check_sub_repos_metrics(out_index, tools.project_types(params),
                                           {'metrics_milestone_persona': True, 'from-date': from_date, 'to-date': end_date})
         params['metrics_milestone_persona_finished_at'] = datetime.now()
     else:
@@ -1189,11 +1336,6 @@ def metrics_role_persona(*args, **kwargs):
     params['metrics_role_persona_started_at'] = datetime.now()
 
     if params.get('metrics_role_persona'):
-        elastic_url = config.get('ES_URL')
-        is_https = urlparse(elastic_url).scheme == 'https'
-        es_client = Elasticsearch(
-            elastic_url, use_ssl=is_https, verify_certs=False, connection_class=RequestsHttpConnection,
-            timeout=180, max_retries=3, retry_on_timeout=True)
         out_index = params['model_role_persona_index']
         from_date = params.get('from-date') if params.get('from-date') else config.get('METRICS_FROM_DATE')
         end_date = params.get('to-date') if params.get('to-date') else datetime.now().strftime('%Y-%m-%d')
@@ -1217,11 +1359,11 @@ def metrics_role_persona(*args, **kwargs):
             'json_file': params['metrics_data_path'],
             'contributors_enriched_index': params['project_contributors_enriched_index']
         }
-        params['metrics_role_persona_params'] = metrics_cfg
-        model_role_persona = RolePersonaMetricsModel(**metrics_cfg['params'])
+        params_store.put(params, 'metrics_role_persona_params', metrics_cfg)
+        model_role_persona = model_registry.load_model('role_persona')(**metrics_cfg['params'])
         model_role_persona.metrics_model_metrics(metrics_cfg['url'])
         if params['level'] == 'community' and params.get('refresh_sub_repos'):
-            tools.check_sub_repos_metrics(es_client, out_index, params['project_types'],
+            tools.check_sub_repos_metrics(out_index, tools.project_types(params),
                                           {'metrics_role_persona': True, 'from-date': from_date, 'to-date': end_date})
         params['metrics_role_persona_finished_at'] = datetime.now()
     else:
@@ -1232,47 +1374,95 @@ def metrics_role_persona(*args, **kwargs):
 @task(name="etl_v1.finish", autoretry_for=(Exception,), retry_kwargs={'max_retries': 3}, acks_late=True)
 def finish(*args, **kwargs):
     params = args[0][0] if type(args[0]) == list else args[0]
+    if params.get('duplicate_of'):
+        return params
+    workflow_pruning.record_skipped(params)
+    routing.record_duration(params)
     label = params.get('project_url') or params.get('project_key')
     message = {
         'label': label,
         'level': params['level'],
         'origin': params.get('domain_name'),
         'status': 'complete',
-        'count': 1 if params['level'] == 'repo' else tools.count_repos(params['project_yaml']),
+        'count': 1 if params['level'] == 'repo' else tools.count_repos(params_store.get(params, 'project_yaml')),
         'status_updated_at': datetime.isoformat(datetime.utcnow())
     }
-    tools.basic_publish('subscriptions_update_v1', message, config.get('RABBITMQ_URI'))
-    tools.basic_publish('third_party_callback_v1', message, config.get('RABBITMQ_URI'))
+    tools.basic_publish_many(['subscriptions_update_v1', 'third_party_callback_v1'], message, config.get('RABBITMQ_URI'))
     return params
 
-@task(name="etl_v1.notify", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
-def notify(*args, **kwargs):
+def callback_body(callback, target, level, domain_name, error=None):
+    if callback['params'].get("callback_type", "") != "tpc_software_callback":
+        label = urllib.parse.quote(target, safe='')
+        compass_host = "https://oss-compass.org"
+        if domain_name in ['gitee', 'gitcode']:
+            compass_host = "https://compass.gitee.com"
+        report_url = f"{compass_host}/analyze?label={label}&level={level}"
+        callback['params']['password'] = config.get('HOOK_PASS')
+        callback['params']['domain'] = domain_name
+        if error:
+            callback['params']['result'] = {'status': False, 'message': f"The analysis you submitted has failed: {error}"}
+        else:
+            callback['params']['result'] = {'status': True, 'message': f"The analysis you submitted has been completed, and the address of the analysis report is: Report Link: {report_url}"}
+    else:
+        callback['params']['project_url'] = target + ".git"
+        callback['params']['command_list'] = ["compass"]
+        callback['params']['scan_results'] = { "compass": { "status": not error } }
+    return callback['params']
+
+def queue_callback(hook_url, body, source, request):
+    """Write the callback to the outbox and wake up a sender, workflows never wait on the hooks"""
+    entry_id = outbox.enqueue(hook_url, body, source)
+    queue = config.get('OUTBOX_QUEUE') or (request.delivery_info or {}).get('routing_key')
+    deliver_callbacks.apply_async(queue=queue)
+    return entry_id
+
+@cel.task(name="etl_v1.deliver_callbacks", acks_late=True, autoretry_for=(Exception,),
+          retry_backoff=5, retry_backoff_max=600, retry_kwargs={'max_retries': 20})
+def deliver_callbacks():
+    """Deliver the due callbacks of the outbox, then schedule one sender for those backing off"""
+    outbox.scheduled_ran()
+    delivered, failed = outbox.drain()
+    countdown = outbox.next_due()
+    if countdown is not None and outbox.schedule_once(countdown):
+        queue = config.get('OUTBOX_QUEUE') or (deliver_callbacks.request.delivery_info or {}).get('routing_key')
+        deliver_callbacks.apply_async(countdown=countdown, queue=queue)
+    return {'delivered': delivered, 'failed': failed}
+
+@task(name="etl_v1.notify", bind=True, acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
+def notify(self, *args, **kwargs):
     params = args[0][0] if type(args[0]) == list else args[0]
     callback = params['callback']
     target = params.get('project_url') or params.get('project_key')
     level = params.get('level') or 'repo'
     domain_name = params.get('domain_name')
+    if params.get('duplicate_of'):
+        return {'status': True, 'message': f"attached to workflow {params['duplicate_of']}"}
+
+    # callbacks of the duplicated workflows attached to this run
+    for attached in dedup.release(params, str(kwargs.get('workflow_id'))):
+        if validate_callback(attached):
+            queue_callback(attached['hook_url'], callback_body(attached, target, level, domain_name), self.name, self.request)
+
     if validate_callback(callback):
-        if callback['params'].get("callback_type", "") != "tpc_software_callback":
-            label = urllib.parse.quote(target, safe='')
-            compass_host = "https://oss-compass.org"
-            if domain_name in ['gitee', 'gitcode']:
-                compass_host = "https://compass.gitee.com"
-            report_url = f"{compass_host}/analyze?label={label}&level={level}"
-            callback['params']['password'] = config.get('HOOK_PASS')
-            callback['params']['domain'] = params['domain_name']
-            callback['params']['result'] = {'status': True, 'message': f"The analysis you submitted has been completed, and the address of the analysis report is: Report Link: {report_url}"}
-            resp = requests.post(callback['hook_url'], json=callback['params'])
-            return {'status': True, 'code': resp.status_code, 'message': resp.text}
-        else:
-            callback['params']['project_url'] = target + ".git"
-            callback['params']['command_list'] = ["compass"]
-            callback['params']['scan_results'] = { "compass": { "status": True } }
-            resp = requests.post(callback['hook_url'], json=callback['params'])
-            return {'status': True, 'code': resp.status_code, 'message': resp.text}
+        entry_id = queue_callback(callback['hook_url'], callback_body(callback, target, level, domain_name), self.name, self.request)
+        return {'status': True, 'message': f"callback queued as {entry_id}"}
     else:
         return {'status': False, 'message': 'no callback'}
 
+@task_failure.connect
+def release_failed_run(sender=None, exception=None, args=None, kwargs=None, **extra):
+    """Release the dedup lease of a run failing for good and fail the callbacks attached to it"""
+    if sender is None or not sender.name.startswith('etl_v1.') or not args:
+        return
+    params = args[0][0] if type(args[0]) == list else args[0]
+    if not isinstance(params, dict) or not params.get('dedup_key'):
+        return
+    target = params.get('project_url') or params.get('project_key')
+    for attached in dedup.release(params, str((kwargs or {}).get('workflow_id'))):
+        if validate_callback(attached):
+            body = callback_body(attached, target, params.get('level') or 'repo', params.get('domain_name'), error=str(exception))
+            queue_callback(attached['hook_url'], body, sender.name, sender.request)
+
 @task(name="etl_v1.license", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def license(*args, **kwargs):
     params = args[0][0] if type(args[0]) == list else args[0]
@@ -1281,34 +1471,10 @@ def license(*args, **kwargs):
         params['license_finished_at'] = 'skipped'
         return params
 
-    payload = {
-        "username": config.get('TPC_SERVICE_API_USERNAME'),
-        "password": config.get('TPC_SERVICE_API_PASSWORD')
-    }
-
-    def base_post_request(request_path, payload, token=None):
-        headers = {"Content-Type": "application/json"}
-        if token:
-            headers["Authorization"] = f"Bearer {token}"
-        try:
-            TPC_SERVICE_API_ENDPOINT = config.get('TPC_SERVICE_API_ENDPOINT')
-            response = requests.post(
-                f"{TPC_SERVICE_API_ENDPOINT}/{request_path}",
-                json=payload,
-                headers=headers
-            )
-            response.raise_for_status()
-            resp_data = response.json()
-            if "error" in resp_data:
-                return {"status": False, "message": f"Error: {resp_data.get('description', 'Unknown error')}"}
-            return {"status": True, "body": resp_data}
-        except requests.RequestException as ex:
-            return {"status": False, "message": str(ex)}
-
-    result = base_post_request("auth", payload)
-    if not result["status"]:
+    # the access token is shared by the tpc stages of every workflow of the process
+    tpc = tpc_client.get_tpc_client()
+    if not tpc.access_token():
         return {'status': False, 'message': 'no auth'}
-    token = result["body"]["access_token"]
 
     commands = ["scancode","osv-scanner"]
     TPC_SERVICE_CALLBACK_URL = config.get("TPC_SERVICE_SERVICE_CALLBACK_URL")
@@ -1320,9 +1486,9 @@ def license(*args, **kwargs):
             "report_type": -1
         }
     }
-    result = base_post_request("opencheck", payload, token=token)
+    result = tpc.opencheck(payload)
     # print(f"Analyze metric by TPC service info: {result}")
-    if result["status"]:
+    if result and result["status"]:
         license_result = {'status': True, 'message': result['body']}
         params["license_result"] = license_result
         return params
@@ -1340,12 +1506,6 @@ def metric(*args, **kwargs):
 
     params['custom_metrics_started_at'] = datetime.now()
     if params.get('custom_metrics'):
-        elastic_url = config.get('ES_URL')
-        is_https = urlparse(elastic_url).scheme == 'https'
-        es_client = Elasticsearch(
-            elastic_url, use_ssl=is_https, verify_certs=False, connection_class=RequestsHttpConnection,
-            timeout=180, max_retries=3, retry_on_timeout=True)
-
 
         metrics_param = params.get('metrics_param')
         # custom metrics_param
@@ -1378,9 +1538,9 @@ def metric(*args, **kwargs):
             'contributors_enriched_index': params['project_contributors_enriched_index'],
             'metrics_param': metrics_param
         }
-        params['custom_metrics_params'] = metrics_cfg
+        params_store.put(params, 'custom_metrics_params', metrics_cfg)
 
-        model_role_persona = MetricsModelCustom(**metrics_cfg['params'])
+        model_role_persona = model_registry.load_model('custom_metrics')(**metrics_cfg['params'])
         model_role_persona.metrics_model_custom(metrics_cfg['url'])
 
         params['custom_metrics'] = datetime.now()
@@ -1397,11 +1557,6 @@ def metrics_criticality_score(*args, **kwargs):
     params['metrics_criticality_score_started_at'] = datetime.now()
 
     if params.get('metrics_criticality_score'):
-        elastic_url = config.get('ES_URL')
-        is_https = urlparse(elastic_url).scheme == 'https'
-        es_client = Elasticsearch(
-            elastic_url, use_ssl=is_https, verify_certs=False, connection_class=RequestsHttpConnection,
-            timeout=180, max_retries=3, retry_on_timeout=True)
         out_index = params['model_criticality_score_index']
         from_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
         end_date = datetime.now().strftime('%Y-%m-%d')
@@ -1424,11 +1579,11 @@ def metrics_criticality_score(*args, **kwargs):
             'source': params['domain_name'],
             'json_file': params['metrics_data_path']
         }
-        params['metrics_criticality_score_params'] = metrics_cfg
-        model_criticality_score = CriticalityScoreMetricsModel(**metrics_cfg['params'])
+        params_store.put(params, 'metrics_criticality_score_params', metrics_cfg)
+        model_criticality_score = model_registry.load_model('criticality_score')(**metrics_cfg['params'])
         model_criticality_score.metrics_model_metrics(metrics_cfg['url'])
         if params['level'] == 'community' and params.get('refresh_sub_repos'):
-            tools.check_sub_repos_metrics(es_client, out_index, params['project_types'],
+            tools.check_sub_repos_metrics(out_index, tools.project_types(params),
                                           {'metrics_criticality_score': True, 'from-date': from_date, 'to-date': end_date})
         params['metrics_criticality_score_finished_at'] = datetime.now()
     else:
@@ -1444,34 +1599,10 @@ def opencheck_raw(*args, **kwargs):
         params['opencheck_raw_finished_at'] = 'skipped'
         return params
 
-    payload = {
-        "username": config.get('TPC_SERVICE_API_USERNAME'),
-        "password": config.get('TPC_SERVICE_API_PASSWORD')
-    }
-
-    def base_post_request(request_path, payload, token=None):
-        headers = {"Content-Type": "application/json"}
-        if token:
-            headers["Authorization"] = f"Bearer {token}"
-        try:
-            TPC_SERVICE_API_ENDPOINT = config.get('TPC_SERVICE_API_ENDPOINT')
-            response = requests.post(
-                f"{TPC_SERVICE_API_ENDPOINT}/{request_path}",
-                json=payload,
-                headers=headers
-            )
-            response.raise_for_status()
-            resp_data = response.json()
-            if "error" in resp_data:
-                return {"status": False, "message": f"Error: {resp_data.get('description', 'Unknown error')}"}
-            return {"status": True, "body": resp_data}
-        except requests.RequestException as ex:
-            return {"status": False, "message": str(ex)}
-
-    result = base_post_request("auth", payload)
-    if not result["status"]:
+    # the access token is shared by the tpc stages of every workflow of the process
+    tpc = tpc_client.get_tpc_client()
+    if not tpc.access_token():
         return {'status': False, 'message': 'no auth'}
-    token = result["body"]["access_token"]
 
     commands = params['opencheck_raw_param'].get('commands')
     if not commands:
@@ -1496,8 +1627,8 @@ def opencheck_raw(*args, **kwargs):
             "metrics_model": metrics_model_list
         }
     }
-    result = base_post_request("opencheck", payload, token=token)
-    if result["status"]:
+    result = tpc.opencheck(payload)
+    if result and result["status"]:
         opencheck_raw_result = {'status': True, 'message': result['body']}
         params["opencheck_raw_result"] = opencheck_raw_result
         return params
@@ -1515,11 +1646,6 @@ def metrics_scorecard(*args, **kwargs):
     params['metrics_scorecard_started_at'] = datetime.now()
 
     if params.get('metrics_scorecard'):
-        elastic_url = config.get('ES_URL')
-        is_https = urlparse(elastic_url).scheme == 'https'
-        es_client = Elasticsearch(
-            elastic_url, use_ssl=is_https, verify_certs=False, connection_class=RequestsHttpConnection,
-            timeout=180, max_retries=3, retry_on_timeout=True)
         out_index = params['model_scorecard_index']
         from_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
         end_date = datetime.now().strftime('%Y-%m-%d')
@@ -1544,9 +1670,9 @@ def metrics_scorecard(*args, **kwargs):
             'contributors_enriched_index': params['project_contributors_enriched_index'],
             'openchecker_index': params['project_opencheck_index'],
         }
-        params['metrics_scorecard_params'] = metrics_cfg
+        params_store.put(params, 'metrics_scorecard_params', metrics_cfg)
         
-        model_scorecard = ScorecardMetricsModel(**metrics_cfg['params'])
+        model_scorecard = model_registry.load_model('scorecard')(**metrics_cfg['params'])
         model_scorecard.metrics_model_metrics(metrics_cfg['url'])
         
         params['metrics_scorecard_finished_at'] = datetime.now()
@@ -1581,11 +1707,6 @@ def metrics_role_persona(*args, **kwargs):
     params['metrics_role_persona_started_at'] = datetime.now()
 
     if params.get('metrics_role_persona'):
-        elastic_url = config.get('ES_URL')
-        is_https = urlparse(elastic_url).scheme == 'https'
-        es_client = Elasticsearch(
-            elastic_url, use_ssl=is_https, verify_certs=False, connection_class=RequestsHttpConnection,
-            timeout=180, max_retries=3, retry_on_timeout=True)
         out_index = params['model_role_persona_index']
         from_date = params.get('from-date') if params.get('from-date') else config.get('METRICS_FROM_DATE')
         end_date = params.get('to-date') if params.get('to-date') else datetime.now().strftime('%Y-%m-%d')
@@ -1609,11 +1730,11 @@ def metrics_role_persona(*args, **kwargs):
             'json_file': params['metrics_data_path'],
             'contributors_enriched_index': params['project_contributors_enriched_index']
         }
-        params['metrics_role_persona_params'] = metrics_cfg
-        model_role_persona = RolePersonaMetricsModel(**metrics_cfg['params'])
+        params_store.put(params, 'metrics_role_persona_params', metrics_cfg)
+        model_role_persona = model_registry.load_model('role_persona')(**metrics_cfg['params'])
         model_role_persona.metrics_model_metrics(metrics_cfg['url'])
         if params['level'] == 'community' and params.get('refresh_sub_repos'):
-            tools.check_sub_repos_metrics(es_client, out_index, params['project_types'],
+            tools.check_sub_repos_metrics(out_index, tools.project_types(params),
                                           {'metrics_role_persona': True, 'from-date': from_date, 'to-date': end_date})
         params['metrics_role_persona_finished_at'] = datetime.now()
     else:
@@ -1623,7 +1744,7 @@ def metrics_role_persona(*args, **kwargs):
 
 
 
-def process_metrics_task(params, task_key, model_class):
+def process_metrics_task(params, task_key, fused=False):
     """
         通用指标处理逻辑（带异常容错）
         """
@@ -1634,15 +1755,14 @@ def process_metrics_task(params, task_key, model_class):
     task_status = params.get(f'metrics_{task_key}')
     print(f"[{project_key}] 开始执行指标任务: {task_key},  配置项值: {task_status}")
 
+    # computed by etl_v1.metrics.fused
+    if params.get('fused_metrics') and not fused:
+        params[f'metrics_{task_key}_finished_at'] = 'skipped'
+        return params
+
     if params.get(f'metrics_{task_key}'):
         try:
             elastic_url = config.get('ES_URL')
-            is_https = urlparse(elastic_url).scheme == 'https'
-            es_client = Elasticsearch(
-                elastic_url, use_ssl=is_https, verify_certs=False,
-                connection_class=RequestsHttpConnection,
-                timeout=180, max_retries=3, retry_on_timeout=True
-            )
 
             out_index = params[f'model_{task_key}_index']
             from_date = params.get('from-date') or config.get('METRICS_FROM_DATE')
@@ -1674,15 +1794,15 @@ def process_metrics_task(params, task_key, model_class):
                 }
             }
 
-            params[f'metrics_{task_key}_params'] = metrics_cfg
+            params_store.put(params, f'metrics_{task_key}_params', metrics_cfg)
 
-            model_inst = model_class(**metrics_cfg['params'])
+            model_inst = model_registry.load_model(task_key)(**metrics_cfg['params'])
             model_inst.metrics_model_metrics(metrics_cfg['url'])
 
 
             if params['level'] == 'community' and params.get('refresh_sub_repos'):
                 tools.check_sub_repos_metrics(
-                    es_client, out_index, params['project_types'],
+                    out_index, tools.project_types(params),
                     {f'metrics_{task_key}': True, 'from-date': from_date, 'to-date': end_date}
                 )
 
@@ -1699,7 +1819,7 @@ def process_metrics_task(params, task_key, model_class):
     return params
 
 
-def process_opencheck_metrics_task(params, task_key, model_class):
+def process_opencheck_metrics_task(params, task_key):
     """
         通用指标处理逻辑（带异常容错）
         """
@@ -1710,12 +1830,6 @@ def process_opencheck_metrics_task(params, task_key, model_class):
     if params.get(f'metrics_{task_key}'):
         try:
             elastic_url = config.get('ES_URL')
-            is_https = urlparse(elastic_url).scheme == 'https'
-            es_client = Elasticsearch(
-                elastic_url, use_ssl=is_https, verify_certs=False,
-                connection_class=RequestsHttpConnection,
-                timeout=180, max_retries=3, retry_on_timeout=True
-            )
 
             out_index = params[f'model_{task_key}_index']
             from_date = params.get('from-date') or config.get('METRICS_FROM_DATE')
@@ -1748,15 +1862,15 @@ def process_opencheck_metrics_task(params, task_key, model_class):
                 }
             }
 
-            params[f'metrics_{task_key}_params'] = metrics_cfg
+            params_store.put(params, f'metrics_{task_key}_params', metrics_cfg)
 
-            model_inst = model_class(**metrics_cfg['params'])
+            model_inst = model_registry.load_model(task_key)(**metrics_cfg['params'])
             model_inst.metrics_model_metrics(metrics_cfg['url'])
 
 
             if params['level'] == 'community' and params.get('refresh_sub_repos'):
                 tools.check_sub_repos_metrics(
-                    es_client, out_index, params['project_types'],
+                    out_index, tools.project_types(params),
                     {f'metrics_{task_key}': True, 'from-date': from_date, 'to-date': end_date}
                 )
 
@@ -1773,84 +1887,123 @@ def process_opencheck_metrics_task(params, task_key, model_class):
     return params
 
 
+# compass_model_v2 models run by process_metrics_task
+V2_MODELS = [
+    'collaboration_quality',
+    'response_timeliness',
+    'community_popularity',
+    'contribution_activity',
+    'developer_base',
+    'organizational_governance',
+    'personal_governance',
+    'developer_attraction',
+    'developer_promotion',
+    'participation_tier',
+    'core_retention',
+    'core_loss',
+    'core_churn',
+]
+workflow_pruning.fuse('fused_metrics', [f"etl_v1.metrics.{task_key}" for task_key in V2_MODELS])
+
+@task(name="etl_v1.metrics.fused", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
+def metrics_fused(*args, **kwargs):
+    """Run the enabled compass_model_v2 models one after the other in this process.
+
+    Enabled with "fused_metrics", the per-model tasks of GROUP_1 are then
+    pruned from the workflow, or skipped with `PRUNE_DISABLED_TASKS=0`. The
+    models share an in-memory memo of Elasticsearch reads for the run, so
+    the base queries they have in common are sent once.
+    """
+    params = args[0]
+    if not params.get('fused_metrics'):
+        params['metrics_fused_finished_at'] = 'skipped'
+        return params
+    params['metrics_fused_started_at'] = datetime.now()
+    with query_cache.memoized_transport() as memo:
+        for task_key in V2_MODELS:
+            params = process_metrics_task(params, task_key, fused=True)
+    params['metrics_fused_cache'] = {'hits': memo.hits, 'misses': memo.misses, 'invalidations': memo.invalidations}
+    params['metrics_fused_finished_at'] = datetime.now()
+    return params
+
 @task(name="etl_v1.metrics.collaboration_quality", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_collaboration_quality(*args, **kwargs):
-    return process_metrics_task(args[0], 'collaboration_quality', CollaborationQualityMetricsModel)
+    return process_metrics_task(args[0], 'collaboration_quality')
 
 @task(name="etl_v1.metrics.response_timeliness", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_response_timeliness(*args, **kwargs):
-    return process_metrics_task(args[0], 'response_timeliness', ResponseTimelinessMetricsModel)
+    return process_metrics_task(args[0], 'response_timeliness')
 
 @task(name="etl_v1.metrics.community_popularity", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_community_popularity(*args, **kwargs):
-    return process_metrics_task(args[0], 'community_popularity', CommunityPopularityMetricsModel)
+    return process_metrics_task(args[0], 'community_popularity')
 
 @task(name="etl_v1.metrics.contribution_activity", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_contribution_activity(*args, **kwargs):
-    return process_metrics_task(args[0], 'contribution_activity', ContributionActivityMetricsModel)
+    return process_metrics_task(args[0], 'contribution_activity')
 
 @task(name="etl_v1.metrics.developer_base", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_developer_base(*args, **kwargs):
-    return process_metrics_task(args[0], 'developer_base', DeveloperBaseMetricsModel)
+    return process_metrics_task(args[0], 'developer_base')
 
 @task(name="etl_v1.metrics.organizational_governance", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_organizational_governance(*args, **kwargs):
-    return process_metrics_task(args[0], 'organizational_governance', OrganizationalGovernanceMetricsModel)
+    return process_metrics_task(args[0], 'organizational_governance')
 
 @task(name="etl_v1.metrics.personal_governance", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_personal_governance(*args, **kwargs):
-    return process_metrics_task(args[0], 'personal_governance', PersonalGovernanceMetricsModel)
+    return process_metrics_task(args[0], 'personal_governance')
 
 
 
 @task(name="etl_v1.metrics.developer_attraction", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_developer_attraction(*args, **kwargs):
-    return process_metrics_task(args[0], 'developer_attraction', DeveloperAttractionMetricsModel)
+    return process_metrics_task(args[0], 'developer_attraction')
 
 @task(name="etl_v1.metrics.developer_promotion", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_developer_promotion(*args, **kwargs):
-    return process_metrics_task(args[0], 'developer_promotion', DeveloperPromotionMetricsModel)
+    return process_metrics_task(args[0], 'developer_promotion')
 
 @task(name="etl_v1.metrics.participation_tier", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_participation_tier(*args, **kwargs):
-    return process_metrics_task(args[0], 'participation_tier', ParticipationTierMetricsModel)
+    return process_metrics_task(args[0], 'participation_tier')
 
 @task(name="etl_v1.metrics.core_retention", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_core_retention(*args, **kwargs):
-    return process_metrics_task(args[0], 'core_retention', CoreRetentionMetricsModel)
+    return process_metrics_task(args[0], 'core_retention')
 
 @task(name="etl_v1.metrics.core_loss", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_core_loss(*args, **kwargs):
-    return process_metrics_task(args[0], 'core_loss', CoreLossMetricsModel)
+    return process_metrics_task(args[0], 'core_loss')
 
 @task(name="etl_v1.metrics.core_churn", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_core_churn(*args, **kwargs):
-    return process_metrics_task(args[0], 'core_churn', CoreChurnMetricsModel)
+    return process_metrics_task(args[0], 'core_churn')
 
 @task(name="etl_v1.metrics.code_review_quality", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_code_review_quality(*args, **kwargs):
-    return process_opencheck_metrics_task(args[0], 'code_review_quality', CodeReviewQualityMetricsModel)
+    return process_opencheck_metrics_task(args[0], 'code_review_quality')
 
 @task(name="etl_v1.metrics.development_document_quality", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_development_document_quality(*args, **kwargs):
-    return process_opencheck_metrics_task(args[0], 'development_document_quality', DevelopmentDocumentQualityMetricsModel)
+    return process_opencheck_metrics_task(args[0], 'development_document_quality')
 
 @task(name="etl_v1.metrics.trusted_build", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_trusted_build(*args, **kwargs):
-    return process_opencheck_metrics_task(args[0], 'trusted_build', TrustedBuildMetricsModel)
+    return process_opencheck_metrics_task(args[0], 'trusted_build')
 
 @task(name="etl_v1.metrics.maintenance_management", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_maintenance_management(*args, **kwargs):
-    return process_opencheck_metrics_task(args[0], 'maintenance_management', MaintenanceManagementMetricsModel)
+    return process_opencheck_metrics_task(args[0], 'maintenance_management')
 
 @task(name="etl_v1.metrics.release_quality", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_release_quality(*args, **kwargs):
-    return process_opencheck_metrics_task(args[0], 'release_quality', ReleaseQualityMetricsModel)
+    return process_opencheck_metrics_task(args[0], 'release_quality')
 
 @task(name="etl_v1.metrics.legal_compliance", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_legal_compliance(*args, **kwargs):
-    return process_opencheck_metrics_task(args[0], 'legal_compliance', LegalComplianceMetricsModel)
+    return process_opencheck_metrics_task(args[0], 'legal_compliance')
 
 @task(name="etl_v1.metrics.security_management", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_security_management(*args, **kwargs):
-    return process_opencheck_metrics_task(args[0], 'security_management', SecurityManagementMetricsMode)
\ No newline at end of file
+    return process_opencheck_metrics_task(args[0], 'security_management')
\ No newline at end of file
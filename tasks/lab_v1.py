@@ -2,11 +2,7 @@ from director import task, config
 from datetime import datetime
 
 from . import config_logging
-from ..utils import tools
-
-from compass_metrics_model.metrics_model_lab import (
-    StarterProjectHealthMetricsModel
-)
+from ..utils import tools, model_registry
 
 @task(name="lab_v1.extract", bind=True)
 def extract(self, *args, **kwargs):
@@ -56,7 +52,7 @@ def initialize(self, *args, **kwargs):
             'release_index': params['project_release_index']
         }
         params["metrics_starter_project_health_params"] = metrics_cfg
-        model_starter_project_health = StarterProjectHealthMetricsModel(**metrics_cfg['params'])
+        model_starter_project_health = model_registry.load_model('starter_project_health')(**metrics_cfg['params'])
         model_starter_project_health.metrics_model_metrics(metrics_cfg['url'])
         params['metrics_starter_project_health_finished_at'] = datetime.now()
     else:
@@ -1,12 +1,10 @@
 from director import task, config
 
-from compass_contributor.bot import BotService
-from compass_contributor.organization import OrganizationService
-from compass_contributor.contributor_org import ContributorOrgService
-
 import os
 import logging
 
+from ..utils import model_registry
+
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +13,7 @@ logger = logging.getLogger(__name__)
 def update_contributor_org(*args, **kwargs):
     elastic_url = config.get('ES_URL')
     os.environ["HTTPS_PROXY"] = config.get('GITHUB_PROXY')
-    contributor = ContributorOrgService(elastic_url, 'contributor_org', 'github')
+    contributor = model_registry.load_model('contributor_org')(elastic_url, 'contributor_org', 'github')
     contributor.save_by_cncf_gitdm_url()
     logger.info(f"finish init contributor org by cncf gitdm")
 
@@ -23,7 +21,7 @@ def update_contributor_org(*args, **kwargs):
 def update_orgs(*args, **kwargs):
     elastic_url = config.get('ES_URL')
     os.environ["HTTPS_PROXY"] = config.get('GITHUB_PROXY')
-    organization = OrganizationService(elastic_url, 'organizations')
+    organization = model_registry.load_model('organizations')(elastic_url, 'organizations')
     organization.save_by_config_file()
     logger.info(f"finish init organization by config")
 
@@ -31,6 +29,6 @@ def update_orgs(*args, **kwargs):
 def update_bots(*args, **kwargs):
     elastic_url = config.get('ES_URL')
     os.environ["HTTPS_PROXY"] = config.get('GITHUB_PROXY')
-    bot = BotService(elastic_url, 'bots')
+    bot = model_registry.load_model('bots')(elastic_url, 'bots')
     bot.save_by_config_file()
     logger.info(f"finish init organization by config")
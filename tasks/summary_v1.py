@@ -1,13 +1,10 @@
 from director import task, config
-from datetime import datetime
+from datetime import datetime, timezone
 import logging
 
-from compass_metrics_model.metrics_model_summary import (
-   ActivityMetricsSummary,
-   CommunitySupportMetricsSummary,
-   CodeQualityGuaranteeMetricsSummary,
-   OrganizationsActivityMetricsSummary
-)
+from ..utils import summary_marks, model_registry, query_cache, workflow_pruning
+
+logger = logging.getLogger(__name__)
 
 # #Summary Example:
 # {
@@ -15,9 +12,34 @@ from compass_metrics_model.metrics_model_summary import (
 #     "metrics_community_summary":true,
 #     "metrics_codequality_summary":true,
 #     "metrics_group_activity_summary":true,
+#     "fused_summary": false,
+#     "full_rebuild": false,
 #     "from_date": "2000-01-01",
 #     "end_date": "2022-12-25"
 # }
+#
+# Without "full_rebuild" or "from_date", each summary only recomputes the
+# periods with metrics computed since its last run.
+
+# summary key -> model name, the summary class is registered as {key}_summary
+SUMMARY_MODELS = {
+    'activity': 'Activity',
+    'community': 'Community Support and Service',
+    'codequality': 'Code_Quality_Guarantee',
+    'group_activity': 'Code_Quality_Guarantee',
+}
+
+# group tasks of the summaries, run by summary_v1.sum.fused instead with "fused_summary"
+workflow_pruning.fuse('fused_summary', [
+    'summary_v1.sum.activtiy',
+    'summary_v1.sum.community',
+    'summary_v1.sum.codequality',
+    'summary_v1.sum.group_activity_summary',
+])
+
+def summary_indexes(key):
+    """Return the (metrics index, summary index) of a summary"""
+    return f"{config.get('METRICS_OUT_INDEX')}_{key}", f"{config.get('METRICS_OUT_INDEX')}_{key}_summary"
 
 @task(name="summary_v1.initialize", bind=True)
 def initialize(self, *args, **kwargs):
@@ -27,82 +49,70 @@ def initialize(self, *args, **kwargs):
     params['metrics_community_summary'] = bool(payload.get('metrics_community_summary'))
     params['metrics_codequality_summary'] = bool(payload.get('metrics_codequality_summary'))
     params['metrics_group_activity_summary'] = bool(payload.get('metrics_group_activity_summary'))
+    params['fused_summary'] = bool(payload.get('fused_summary'))
     params['from_date'] = payload.get('from_date') or config.get('METRICS_FROM_DATE')
     params['end_date'] = payload.get('end_date') or datetime.now().strftime('%Y-%m-%d')
+    params['summary_started_at'] = datetime.now(timezone.utc).isoformat()
+    enabled = {key: summary_indexes(key) for key in SUMMARY_MODELS if params[f'metrics_{key}_summary']}
+    if payload.get('full_rebuild') or payload.get('from_date'):
+        params['summary_from_dates'] = {key: params['from_date'] for key in enabled}
+    else:
+        params['summary_from_dates'] = summary_marks.plan(enabled, params['from_date'])
     return params
 
-@task(name="summary_v1.sum.activtiy", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
-def metrics_activity_summary(*args, **kwargs):
-    params = args[0]
-    params['metrics_activity_summary_started_at'] = datetime.now()
-    if params.get('metrics_activity_summary'):
-        activity_summary = ActivityMetricsSummary(
-            f"{config.get('METRICS_OUT_INDEX')}_activity",
-            'Activity',
-            params['from_date'],
-            params['end_date'],
-            f"{config.get('METRICS_OUT_INDEX')}_activity_summary"
-        )
+def process_summary_task(params, key, fused=False):
+    params[f'metrics_{key}_summary_started_at'] = datetime.now()
+    # computed by summary_v1.sum.fused
+    if params.get('fused_summary') and not fused:
+        params[f'metrics_{key}_summary_finished_at'] = 'skipped'
+        return params
+    from_date = params.get('summary_from_dates', {}).get(key, params['from_date'])
+    if params.get(f'metrics_{key}_summary') and from_date:
+        model_class = model_registry.load_model(f'{key}_summary')
+        model_name = SUMMARY_MODELS[key]
+        metrics_index, out_index = summary_indexes(key)
+        logger.info(f"Summarizing {metrics_index} from {from_date} to {params['end_date']}")
+        summary = model_class(metrics_index, model_name, from_date, params['end_date'], out_index)
         elastic_url = config.get('ES_URL')
-        activity_summary.metrics_model_summary(elastic_url)
-        params['metrics_activity_summary_finished_at'] = datetime.now()
+        summary.metrics_model_summary(elastic_url)
+        summary_marks.record(out_index, params['summary_started_at'])
+        params[f'metrics_{key}_summary_finished_at'] = datetime.now()
     else:
-        params['metrics_activity_summary_finished_at'] = 'skipped'
+        params[f'metrics_{key}_summary_finished_at'] = 'skipped'
     return params
 
-@task(name="summary_v1.sum.community", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
-def metrics_community_summary(*args, **kwargs):
+@task(name="summary_v1.sum.fused", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
+def metrics_fused_summary(*args, **kwargs):
+    """Run the enabled summaries one after the other in this task, enabled with "fused_summary".
+
+    The per-model tasks are then pruned from the workflow. The summaries
+    still scan their metrics indexes on their own, they only share an
+    in-memory memo of their identical Elasticsearch reads for the run.
+    """
     params = args[0]
-    params['metrics_community_summary_started_at'] = datetime.now()
-    if params.get('metrics_community_summary'):
-        community_summary = CommunitySupportMetricsSummary(
-            f"{config.get('METRICS_OUT_INDEX')}_community",
-            'Community Support and Service',
-            params['from_date'],
-            params['end_date'],
-            f"{config.get('METRICS_OUT_INDEX')}_community_summary"
-        )
-        elastic_url = config.get('ES_URL')
-        community_summary.metrics_model_summary(elastic_url)
-        params['metrics_community_summary_finished_at'] = datetime.now()
-    else:
-        params['metrics_community_summary_finished_at'] = 'skipped'
+    if not params.get('fused_summary'):
+        params['metrics_fused_summary_finished_at'] = 'skipped'
+        return params
+    params['metrics_fused_summary_started_at'] = datetime.now()
+    with query_cache.memoized_transport() as memo:
+        for key in SUMMARY_MODELS:
+            params = process_summary_task(params, key, fused=True)
+    params['metrics_fused_summary_cache'] = {'hits': memo.hits, 'misses': memo.misses, 'invalidations': memo.invalidations}
+    params['metrics_fused_summary_finished_at'] = datetime.now()
     return params
 
+@task(name="summary_v1.sum.activtiy", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
+def metrics_activity_summary(*args, **kwargs):
+    return process_summary_task(args[0], 'activity')
+
+@task(name="summary_v1.sum.community", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
+def metrics_community_summary(*args, **kwargs):
+    return process_summary_task(args[0], 'community')
+
 @task(name="summary_v1.sum.codequality", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_codequality_summary(*args, **kwargs):
-    params = args[0]
-    params['metrics_codequality_summary_started_at'] = datetime.now()
-    if params.get('metrics_codequality_summary'):
-        codequality_summary = CodeQualityGuaranteeMetricsSummary(
-            f"{config.get('METRICS_OUT_INDEX')}_codequality",
-            'Code_Quality_Guarantee',
-            params['from_date'],
-            params['end_date'],
-            f"{config.get('METRICS_OUT_INDEX')}_codequality_summary"
-        )
-        elastic_url = config.get('ES_URL')
-        codequality_summary.metrics_model_summary(elastic_url)
-        params['metrics_codequality_summary_finished_at'] = datetime.now()
-    else:
-        params['metrics_codequality_summary_finished_at'] = 'skipped'
-    return params
+    return process_summary_task(args[0], 'codequality')
 
 @task(name="summary_v1.sum.group_activity_summary", acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def metrics_group_activity_summary(*args, **kwargs):
-    params = args[0]
-    params['metrics_group_activity_summary_started_at'] = datetime.now()
-    if params.get('metrics_group_activity_summary'):
-        organizations_activity_summary = OrganizationsActivityMetricsSummary(
-            f"{config.get('METRICS_OUT_INDEX')}_group_activity",
-            'Code_Quality_Guarantee',
-            params['from_date'],
-            params['end_date'],
-            f"{config.get('METRICS_OUT_INDEX')}_group_activity_summary"
-        )
-        elastic_url = config.get('ES_URL')
-        organizations_activity_summary.metrics_model_summary(elastic_url)
-        params['metrics_group_activity_summary_finished_at'] = datetime.now()
-    else:
-        params['metrics_group_activity_summary_finished_at'] = 'skipped'
-    return params
+    return process_summary_task(args[0], 'group_activity')
@@ -0,0 +1,84 @@
+"""Cost based routing of insight.ETL_V1_ROUTE.
+
+    export DIRECTOR_HOME=/path/to/compass-service-scheduler
+    python -m unittest discover tests
+"""
+import os
+import sys
+import types
+import tempfile
+import unittest
+import importlib
+
+from datetime import datetime
+from unittest import mock
+from os.path import abspath, dirname, join
+
+ROOT = abspath(join(dirname(__file__), '..'))
+PACKAGE = 'compass_scheduler'
+
+
+def load_module(name):
+    """Import a module of the repo the way director does, as a package named after the repo"""
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [ROOT]
+        sys.modules[PACKAGE] = package
+    return importlib.import_module(f"{PACKAGE}.{name}")
+
+
+class EstimateCostTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        os.environ.setdefault('DIRECTOR_HOME', ROOT)
+        from director import config
+        config.init()
+        cls.routing = load_module('utils.routing')
+        cls.watermarks = load_module('utils.watermarks')
+
+    def setUp(self):
+        self.configs_dir = tempfile.mkdtemp(prefix='compass-routing-')
+        self.payload = {'project_url': 'https://github.com/oss-compass/compass-web', 'raw': True, 'enrich': True}
+        patches = [
+            mock.patch.object(self.routing.tools, 'project_configs_dir', return_value=self.configs_dir),
+            mock.patch.object(self.routing, 'last_duration', return_value=None),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def advance_every_backend(self):
+        for backend in self.routing.DEFAULT_RAW_ENRICH_SETUP:
+            self.watermarks.advance(self.configs_dir, backend, datetime(2024, 1, 1),
+                                    [self.payload['project_url']])
+
+    def test_first_incremental_run_is_a_full_collection(self):
+        self.assertTrue(self.routing.first_collection(self.payload))
+        backends = len(self.routing.DEFAULT_RAW_ENRICH_SETUP)
+        self.assertEqual(self.routing.estimate_cost(self.payload),
+                         backends * self.routing.FULL_COLLECTION_FACTOR * self.routing.DEFAULT_BACKEND_SECONDS)
+        self.assertEqual(self.routing.route_workflow(self.payload)[0], 'ETL_V1_MEDIUM')
+
+    def test_run_with_watermarks_is_incremental(self):
+        self.advance_every_backend()
+        self.assertFalse(self.routing.first_collection(self.payload))
+        backends = len(self.routing.DEFAULT_RAW_ENRICH_SETUP)
+        self.assertEqual(self.routing.estimate_cost(self.payload), backends * self.routing.DEFAULT_BACKEND_SECONDS)
+        self.assertEqual(self.routing.route_workflow(self.payload)[0], 'ETL_V1_SMALL')
+
+    def test_new_repo_is_a_full_collection(self):
+        self.advance_every_backend()
+        self.payload['project_url'] = 'https://github.com/oss-compass/compass-metrics-model'
+        self.assertTrue(self.routing.first_collection(self.payload))
+
+    def test_run_kind_of_params(self):
+        self.assertEqual(self.routing.run_kind({'raw': True, 'incremental': True}), 'collect')
+        self.assertEqual(self.routing.run_kind({'raw': True, 'incremental': True, 'full_collection': True}), 'full')
+        self.assertEqual(self.routing.run_kind({'raw': True, 'incremental': False}), 'full')
+        self.assertEqual(self.routing.run_kind({'enrich': True}), 'collect')
+        self.assertEqual(self.routing.run_kind({}), 'metrics')
+
+
+if __name__ == '__main__':
+    unittest.main()
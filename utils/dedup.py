@@ -0,0 +1,94 @@
+import json
+import logging
+
+import redis
+
+from director import config
+
+from .redis_client import get_redis
+from .tools import hash_string
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'compass:workflow'
+DEFAULT_LEASE_SECONDS = 12 * 3600
+STAGE_FLAGS = ['raw', 'enrich', 'identities_load', 'identities_merge', 'panels', 'opencheck_raw', 'license',
+               'custom_metrics', 'force_refresh_enriched']
+
+# take the lease, or register the callback of the duplicate on the lease holder
+ACQUIRE_SCRIPT = """
+if redis.call('set', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return ARGV[1]
+end
+local owner = redis.call('get', KEYS[1])
+if owner ~= ARGV[1] and ARGV[3] ~= '' then
+    redis.call('rpush', KEYS[2], ARGV[3])
+    redis.call('expire', KEYS[2], ARGV[2])
+end
+return owner
+"""
+
+# pop the attached callbacks and delete the lease if it is still held by the workflow
+RELEASE_SCRIPT = """
+local callbacks = redis.call('lrange', KEYS[2], 0, -1)
+redis.call('del', KEYS[2])
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('del', KEYS[1])
+end
+return callbacks
+"""
+
+
+def enabled_stages(params):
+    return sorted(k for k, v in params.items()
+                  if v is True and (k in STAGE_FLAGS or k.startswith('metrics_')))
+
+def lease_key(params):
+    """Key of the runs of a project requesting the same stages over the same period"""
+    stages = {
+        'stages': enabled_stages(params),
+        'from-date': params.get('from-date'),
+        'to-date': params.get('to-date'),
+        'period': params.get('period')
+    }
+    return f"{KEY_PREFIX}:{params['project_hash']}:{hash_string(json.dumps(stages, sort_keys=True))}"
+
+def acquire_or_attach(params, workflow_id):
+    """Take the lease of the project for `workflow_id`, or attach to the run already holding it.
+
+    Return the id of the in-flight workflow this one was attached to, None
+    when this workflow owns the run. When Redis is unreachable every
+    workflow runs on its own.
+    """
+    key = lease_key(params)
+    try:
+        ttl = int(config.get('WORKFLOW_DEDUP_LEASE_SECONDS') or DEFAULT_LEASE_SECONDS)
+        callback = json.dumps(params['callback']) if params.get('callback') else ''
+        owner = get_redis().eval(ACQUIRE_SCRIPT, 2, key, f"{key}:callbacks", workflow_id, ttl, callback)
+    except redis.RedisError as e:
+        logger.warning(f"Skip workflow deduplication of {params['project_hash']}: {e}")
+        return None
+    owner = owner.decode('utf-8') if isinstance(owner, bytes) else owner
+    if owner == workflow_id:
+        params['dedup_key'] = key
+        return None
+    return owner
+
+def as_duplicate(params, owner):
+    """Turn off every stage of a duplicated workflow, the in-flight one will notify its callback"""
+    params['duplicate_of'] = owner
+    for stage in enabled_stages(params):
+        params[stage] = False
+    return params
+
+def release(params, workflow_id):
+    """Release the lease and return the callbacks attached by duplicated workflows"""
+    key = params.get('dedup_key')
+    if not key:
+        return []
+    try:
+        callbacks = get_redis().eval(RELEASE_SCRIPT, 2, key, f"{key}:callbacks", workflow_id)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to release workflow lease {key}: {e}")
+        return []
+    return [json.loads(callback) for callback in callbacks]
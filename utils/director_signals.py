@@ -0,0 +1,38 @@
+import logging
+
+from celery.signals import task_prerun, task_postrun
+
+logger = logging.getLogger(__name__)
+
+# receivers of director tracking the status of its tasks in the database
+DIRECTOR_RECEIVERS = {task_prerun: 'director_prerun', task_postrun: 'director_postrun'}
+
+
+def director_tasks_only(receiver, base_class):
+    """Call a director receiver for the tasks of the workflows only.
+
+    The subtasks sent with plain `cel.task` (etl_v1.shard,
+    etl_v1.deliver_callbacks) have no Task row, director would fail to
+    look it up.
+    """
+    def guarded_receiver(sender=None, *args, **kwargs):
+        task = kwargs.get('task') or sender
+        if isinstance(task, base_class):
+            return receiver(sender=sender, *args, **kwargs)
+    guarded_receiver.director_tasks_only = True
+    return guarded_receiver
+
+def install():
+    try:
+        from director.tasks import base
+    except ImportError:
+        logger.warning("Director task signals not found, plain celery tasks are not excluded")
+        return
+    for signal, name in DIRECTOR_RECEIVERS.items():
+        receiver = getattr(base, name, None)
+        if receiver is None or getattr(receiver, 'director_tasks_only', False):
+            continue
+        signal.disconnect(receiver)
+        guarded = director_tasks_only(receiver, base.BaseTask)
+        signal.connect(guarded, weak=False)
+        setattr(base, name, guarded)
@@ -0,0 +1,61 @@
+import os
+import threading
+import logging
+
+from urllib.parse import urlparse
+
+from director import config
+from elasticsearch import Elasticsearch, Transport, Urllib3HttpConnection
+
+from .instrumentation import count_es_request
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 16
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def install():
+    """Count the Elasticsearch requests of every client of the process, the models create their own clients.
+
+    Installed before the query cache, so the requests it answers are not
+    counted as sent.
+    """
+    if getattr(Transport.perform_request, 'counted', False):
+        return
+    perform_request = Transport.perform_request
+
+    def counted_perform_request(self, method, url, *args, **kwargs):
+        count_es_request(method, url)
+        return perform_request(self, method, url, *args, **kwargs)
+
+    counted_perform_request.counted = True
+    Transport.perform_request = counted_perform_request
+
+
+def get_es_client(elastic_url=None):
+    """Return the Elasticsearch client of this worker process for `elastic_url` (default `ES_URL`).
+
+    Clients are created on first use and reused by every task running in the
+    process. They keep a pool of `ES_POOL_SIZE` keep-alive connections and
+    compress request bodies. The registry is keyed by pid so a forked worker
+    never reuses the sockets of its parent.
+    """
+    elastic_url = elastic_url or config.get('ES_URL')
+    key = (os.getpid(), elastic_url)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                is_https = urlparse(elastic_url).scheme == 'https'
+                client = Elasticsearch(
+                    elastic_url, use_ssl=is_https, verify_certs=False,
+                    connection_class=Urllib3HttpConnection,
+                    maxsize=int(config.get('ES_POOL_SIZE') or DEFAULT_POOL_SIZE), http_compress=True,
+                    timeout=180, max_retries=3, retry_on_timeout=True)
+                _clients[key] = client
+                logger.debug(f"Created Elasticsearch client for process {os.getpid()}")
+    return client
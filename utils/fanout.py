@@ -0,0 +1,55 @@
+import re
+import json
+import threading
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from director import config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FAMILY_CONCURRENCY = 2
+
+
+def backend_family(backend):
+    """Group backend sections sharing the same API tokens, e.g. github:issue, github2:pull, githubql:event -> github"""
+    name = backend.split(':')[0]
+    return re.sub(r'(ql|2)$', '', name)
+
+def family_concurrency():
+    """Return the {family: max parallel backends} limits from `BACKEND_FAMILY_CONCURRENCY`"""
+    limits = config.get('BACKEND_FAMILY_CONCURRENCY')
+    return json.loads(limits) if limits else {}
+
+def run_backends(backends, run_backend, parallel=False):
+    """Run `run_backend(backend)` for every backend section.
+
+    In parallel mode each backend runs in its own thread, at most
+    `BACKEND_FAMILY_CONCURRENCY[family]` at once per backend family, and the call
+    returns once all of them have finished. The first failure is re-raised
+    after the remaining backends are done so that the task can be retried.
+    """
+    if not parallel or len(backends) < 2:
+        for backend in backends:
+            run_backend(backend)
+        return
+
+    limits = family_concurrency()
+    semaphores = {}
+    for backend in backends:
+        family = backend_family(backend)
+        if family not in semaphores:
+            semaphores[family] = threading.BoundedSemaphore(int(limits.get(family, DEFAULT_FAMILY_CONCURRENCY)))
+
+    def run(backend):
+        with semaphores[backend_family(backend)]:
+            logger.info(f"Begin to run backend {backend}")
+            run_backend(backend)
+            logger.info(f"Finish to run backend {backend}")
+
+    with ThreadPoolExecutor(max_workers=len(backends)) as executor:
+        futures = [executor.submit(run, backend) for backend in backends]
+    errors = [future.exception() for future in futures if future.exception()]
+    if errors:
+        raise errors[0]
@@ -0,0 +1,109 @@
+import os
+import time
+import logging
+
+from contextlib import contextmanager
+
+from celery.signals import worker_init, worker_process_shutdown, task_prerun, task_postrun
+from director import config
+
+logger = logging.getLogger(__name__)
+
+try:
+    from prometheus_client import Counter, Histogram, CollectorRegistry, start_http_server, multiprocess
+except ImportError:
+    Counter = None
+
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400, 28800, 86400)
+
+if Counter:
+    TASK_DURATION = Histogram('compass_task_duration_seconds', 'Duration of scheduler tasks',
+                              ['task', 'queue'], buckets=DURATION_BUCKETS)
+    TASK_OUTCOMES = Counter('compass_task_outcomes_total', 'Outcomes (success, failure, skipped, retry) of scheduler tasks',
+                            ['task', 'queue', 'outcome'])
+    BACKEND_DURATION = Histogram('compass_backend_duration_seconds', 'Duration of micro_mordred per backend and phase',
+                                 ['phase', 'backend'], buckets=DURATION_BUCKETS)
+    ES_REQUESTS = Counter('compass_es_requests_total', 'Elasticsearch requests sent by the scheduler',
+                          ['method', 'endpoint'])
+    QUERY_CACHE_LOOKUPS = Counter('compass_es_query_cache_total', 'Lookups (hit, miss) of the Elasticsearch query cache',
+                                  ['result'])
+    QUERY_CACHE_SAVED = Counter('compass_es_query_cache_saved_seconds_total',
+                                'Elasticsearch latency saved by query cache hits')
+
+_started = {}
+
+
+def enabled():
+    return Counter is not None and bool(config.get('PROMETHEUS_PORT'))
+
+@worker_init.connect
+def start_exporter(*args, **kwargs):
+    """Expose the metrics of the worker on `PROMETHEUS_PORT`.
+
+    With the prefork pool `PROMETHEUS_MULTIPROC_DIR` must point to an empty
+    directory so that the metrics of every child process are aggregated.
+    """
+    if not enabled():
+        return
+    registry = None
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    port = int(config.get('PROMETHEUS_PORT'))
+    if registry:
+        start_http_server(port, registry=registry)
+    else:
+        start_http_server(port)
+    logger.info(f"Prometheus metrics exposed on port {port}")
+
+@worker_process_shutdown.connect
+def mark_process_dead(pid=None, *args, **kwargs):
+    if enabled() and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+@task_prerun.connect
+def task_started(task_id=None, *args, **kwargs):
+    _started[task_id] = time.monotonic()
+
+def task_outcome(state, params, retval):
+    """Tell success from skipped stages and from metrics failures recorded in `_status`"""
+    if state != 'SUCCESS':
+        return state.lower()
+    if isinstance(retval, dict):
+        params = params if isinstance(params, dict) else {}
+        changed = {k: v for k, v in retval.items() if params.get(k) != v}
+        if any(k.endswith('_status') and v == 'failed' for k, v in changed.items()):
+            return 'failure'
+        if any(k.endswith('_finished_at') and v == 'skipped' for k, v in changed.items()):
+            return 'skipped'
+    return 'success'
+
+@task_postrun.connect
+def task_finished(task_id=None, task=None, args=None, retval=None, state=None, *other, **kwargs):
+    started = _started.pop(task_id, None)
+    if not enabled() or started is None or task.name.startswith('director.tasks'):
+        return
+    queue = (task.request.delivery_info or {}).get('routing_key') or 'celery'
+    TASK_DURATION.labels(task.name, queue).observe(time.monotonic() - started)
+    TASK_OUTCOMES.labels(task.name, queue, task_outcome(state or '', args[0] if args else None, retval)).inc()
+
+@contextmanager
+def time_backend(phase, backend):
+    """Observe how long micro_mordred takes for one backend section"""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        if enabled():
+            BACKEND_DURATION.labels(phase, backend).observe(time.monotonic() - started)
+
+def count_es_request(method, url):
+    if enabled():
+        endpoint = next((part for part in reversed(url.split('?')[0].split('/')) if part.startswith('_')), 'document')
+        ES_REQUESTS.labels(method, endpoint).inc()
+
+def count_query_cache(result, saved_seconds=0):
+    if enabled():
+        QUERY_CACHE_LOOKUPS.labels(result).inc()
+        if saved_seconds:
+            QUERY_CACHE_SAVED.inc(saved_seconds)
@@ -0,0 +1,166 @@
+import os
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+import logging.handlers
+
+from collections import OrderedDict
+
+import colorlog
+
+from director import config
+
+DEBUG_LOG_FORMAT = "[%(asctime)s - %(name)s - %(levelname)s] - %(workflow_tag)s%(message)s"
+INFO_LOG_FORMAT = "%(asctime)s %(workflow_tag)s%(message)s"
+COLOR_LOG_FORMAT_SUFFIX = "\033[1m %(log_color)s "
+LOG_COLORS = {'DEBUG': 'white', 'INFO': 'cyan', 'WARNING': 'yellow', 'ERROR': 'red', 'CRITICAL': 'red,bg_white'}
+LOG_FILE_NAME = 'all.log'
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+DEFAULT_MAX_OPEN_FILES = 32
+
+# (debug, logs_dir) of the task running in this context
+_context = contextvars.ContextVar('compass_log_context', default=None)
+_state = {'pid': None, 'listener': None, 'queue': None, 'context': (False, None)}
+_lock = threading.Lock()
+
+
+class TaskFormatter(logging.Formatter):
+    """Format a record with the debug or the info format of the task that logged it"""
+
+    def __init__(self, formatter_class=logging.Formatter, prefix='', **kwargs):
+        super().__init__()
+        self.formatters = {
+            True: formatter_class(fmt=prefix + DEBUG_LOG_FORMAT, **kwargs),
+            False: formatter_class(fmt=prefix + INFO_LOG_FORMAT, **kwargs),
+        }
+
+    def format(self, record):
+        return self.formatters[record.log_debug].format(record)
+
+
+class TaskContextFilter(logging.Filter):
+    """Tag records with the logs dir, the debug flag and the workflow of the current task"""
+
+    def filter(self, record):
+        debug, logs_dir = _context.get() or _state['context']
+        if record.levelno < logging.INFO and not debug:
+            return False
+        record.log_debug = debug
+        record.logs_dir = logs_dir
+        record.workflow_tag = workflow_tag()
+        return True
+
+
+class LogsDirHandler(logging.Handler):
+    """Write each record to the console and to the `all.log` of the logs dir it was tagged with.
+
+    Only the listener thread uses it, so the files are opened, truncated and
+    closed in the order of the records. At most `max_open_files` files stay
+    open, the least recently used one is closed first.
+    """
+
+    def __init__(self, stream, max_open_files):
+        super().__init__()
+        self.stream = stream
+        self.max_open_files = max_open_files
+        self.file_handlers = OrderedDict()
+
+    def file_handler(self, logs_dir, append=True):
+        handler = self.file_handlers.pop(logs_dir, None)
+        if handler is not None and not append:
+            handler.close()
+            handler = None
+        if handler is None:
+            handler = logging.handlers.RotatingFileHandler(
+                os.path.join(logs_dir, LOG_FILE_NAME), mode='a+', maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+            handler.setFormatter(TaskFormatter())
+            if not append:
+                # a rotating handler always opens its file in append mode
+                handler.stream.truncate(0)
+        self.file_handlers[logs_dir] = handler
+        while len(self.file_handlers) > self.max_open_files:
+            self.file_handlers.popitem(last=False)[1].close()
+        return handler
+
+    def emit(self, record):
+        if getattr(record, 'truncate_logs_dir', False):
+            self.file_handler(record.logs_dir, append=False)
+            return
+        self.stream.handle(record)
+        if record.logs_dir:
+            self.file_handler(record.logs_dir).handle(record)
+
+    def close(self):
+        for handler in self.file_handlers.values():
+            handler.close()
+        self.file_handlers.clear()
+        super().close()
+
+
+def workflow_tag():
+    try:
+        from celery import current_task
+        request = current_task.request if current_task else None
+    except ImportError:
+        request = None
+    if not request or not request.id:
+        return ''
+    workflow_id = (request.kwargs or {}).get('workflow_id')
+    return f"[{workflow_id or '-'}/{request.id}] "
+
+def start_listener():
+    """Route the root logger through a queue drained by a listener thread of this process"""
+    with _lock:
+        if _state['pid'] == os.getpid():
+            return
+        # a forked worker inherits the handlers of its parent but not its listener thread
+        log_queue = queue.SimpleQueue()
+        stream = logging.StreamHandler()
+        stream.setFormatter(TaskFormatter(colorlog.ColoredFormatter, COLOR_LOG_FORMAT_SUFFIX, log_colors=LOG_COLORS))
+        max_open_files = int(config.get('LOG_MAX_OPEN_FILES') or DEFAULT_MAX_OPEN_FILES)
+        listener = logging.handlers.QueueListener(log_queue, LogsDirHandler(stream, max_open_files))
+        listener.start()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(TaskContextFilter())
+        root = logging.getLogger()
+        root.handlers.clear()
+        root.addHandler(queue_handler)
+        root.setLevel(logging.INFO)
+        _state['pid'] = os.getpid()
+        _state['listener'] = listener
+        _state['queue'] = log_queue
+        atexit.register(stop_listener)
+
+def stop_listener():
+    """Flush the queued records and close the log files"""
+    listener = _state['listener']
+    if listener is not None and _state['pid'] == os.getpid():
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        _state['listener'] = None
+        _state['pid'] = None
+
+def use_logs_dir(debug, logs_dir, append=True):
+    """Send the records of the current task to `logs_dir`/all.log, at debug level with `debug`.
+
+    The handlers are created once per process and per logs dir, tasks only
+    set their context. Records are queued and written by a listener thread,
+    so a task never waits on the disk; truncating the log with
+    `append=False` is queued the same way.
+    """
+    start_listener()
+    if logs_dir and not append:
+        record = logging.LogRecord('compass', logging.INFO, __file__, 0, '', None, None)
+        record.truncate_logs_dir = True
+        record.logs_dir = logs_dir
+        _state['queue'].put_nowait(record)
+    if debug and logging.getLogger().level > logging.DEBUG:
+        logging.getLogger().setLevel(logging.DEBUG)
+    context = (bool(debug), logs_dir)
+    _context.set(context)
+    # threads started by the task (parallel backends) log with the last context of the process
+    _state['context'] = context
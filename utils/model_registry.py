@@ -0,0 +1,73 @@
+import importlib
+import threading
+
+# task key -> dotted path of the class it runs, imported on first use
+MODELS = {
+    # compass_metrics_model
+    'activity': 'compass_metrics_model.metrics_model.ActivityMetricsModel',
+    'community': 'compass_metrics_model.metrics_model.CommunitySupportMetricsModel',
+    'codequality': 'compass_metrics_model.metrics_model.CodeQualityGuaranteeMetricsModel',
+    'group_activity': 'compass_metrics_model.metrics_model.OrganizationsActivityMetricsModel',
+    'custom_metrics': 'compass_metrics_model.metrics_model_custom.MetricsModelCustom',
+    'starter_project_health': 'compass_metrics_model.metrics_model_lab.StarterProjectHealthMetricsModel',
+    'activity_summary': 'compass_metrics_model.metrics_model_summary.ActivityMetricsSummary',
+    'community_summary': 'compass_metrics_model.metrics_model_summary.CommunitySupportMetricsSummary',
+    'codequality_summary': 'compass_metrics_model.metrics_model_summary.CodeQualityGuaranteeMetricsSummary',
+    'group_activity_summary': 'compass_metrics_model.metrics_model_summary.OrganizationsActivityMetricsSummary',
+
+    # compass_model
+    'base': 'compass_model.base_metrics_model.BaseMetricsModel',
+    'domain_persona': 'compass_model.contributor.productivity.domain_persona_metrics_model.DomainPersonaMetricsModel',
+    'milestone_persona': 'compass_model.contributor.productivity.milestone_persona_metrics_model.MilestonePersonaMetricsModel',
+    'role_persona': 'compass_model.contributor.productivity.role_persona_metrics_model.RolePersonaMetricsModel',
+    'criticality_score': 'compass_model.software_artifact.robustness.criticality_score_metrics_model.CriticalityScoreMetricsModel',
+    'scorecard': 'compass_model.software_artifact.robustness.scorecard_metrics_model.ScorecardMetricsModel',
+
+    # compass_model_v2
+    'collaboration_quality': 'compass_model_v2.community_health.collaboration_efficiency.collaboration_quality_metrics_model.CollaborationQualityMetricsModel',
+    'response_timeliness': 'compass_model_v2.community_health.collaboration_efficiency.response_timeliness_metrics_model.ResponseTimelinessMetricsModel',
+    'community_popularity': 'compass_model_v2.community_health.community_vitality.community_popularity_metrics_model.CommunityPopularityMetricsModel',
+    'contribution_activity': 'compass_model_v2.community_health.community_vitality.contribution_activity_metrics_model.ContributionActivityMetricsModel',
+    'developer_base': 'compass_model_v2.community_health.community_vitality.developer_base_metrics_model.DeveloperBaseMetricsModel',
+    'organizational_governance': 'compass_model_v2.community_health.development_governance.organizational_governance_metrics_model.OrganizationalGovernanceMetricsModel',
+    'personal_governance': 'compass_model_v2.community_health.development_governance.personal_governance_metrics_model.PersonalGovernanceMetricsModel',
+    'developer_attraction': 'compass_model_v2.developer_journey.developer_attraction.developer_attraction_metrics_model.DeveloperAttractionMetricsModel',
+    'developer_promotion': 'compass_model_v2.developer_journey.developer_growth.developer_promotion_metrics_model.DeveloperPromotionMetricsModel',
+    'participation_tier': 'compass_model_v2.developer_journey.developer_growth.participation_tier_metrics_model.ParticipationTierMetricsModel',
+    'core_retention': 'compass_model_v2.developer_journey.developer_retention.core_retention_metrics_model.CoreRetentionMetricsModel',
+    'core_loss': 'compass_model_v2.developer_journey.developer_retention.core_loss_metrics_model.CoreLossMetricsModel',
+    'core_churn': 'compass_model_v2.developer_journey.developer_retention.core_churn_metrics_model.CoreChurnMetricsModel',
+    'code_review_quality': 'compass_model_v2.supply_chain_security.dev_and_build.code_review_quality_metrics_model.CodeReviewQualityMetricsModel',
+    'development_document_quality': 'compass_model_v2.supply_chain_security.dev_and_build.development_document_quality_metrics_model.DevelopmentDocumentQualityMetricsModel',
+    'trusted_build': 'compass_model_v2.supply_chain_security.dev_and_build.trusted_build_metrics_model.TrustedBuildMetricsModel',
+    'maintenance_management': 'compass_model_v2.supply_chain_security.release_and_maintenance.maintenance_management_metrics_model.MaintenanceManagementMetricsModel',
+    'release_quality': 'compass_model_v2.supply_chain_security.release_and_maintenance.release_quality_metrics_model.ReleaseQualityMetricsModel',
+    'legal_compliance': 'compass_model_v2.supply_chain_security.source_management.legal_compliance_metrics_model.LegalComplianceMetricsModel',
+    'security_management': 'compass_model_v2.supply_chain_security.source_management.security_management_metrics_model.SecurityManagementMetricsMode',
+
+    # compass_contributor
+    'contributors_refresh': 'compass_contributor.contributor_dev_org_repo.ContributorDevOrgRepo',
+    'contributor_org': 'compass_contributor.contributor_org.ContributorOrgService',
+    'organizations': 'compass_contributor.organization.OrganizationService',
+    'bots': 'compass_contributor.bot.BotService',
+}
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def load_model(key):
+    """Return the class registered for the task `key`, importing its module on first use"""
+    model_class = _loaded.get(key)
+    if model_class is None:
+        if key not in MODELS:
+            raise Exception(f"No model registered for {key}")
+        module_path, name = MODELS[key].rsplit('.', 1)
+        with _lock:
+            model_class = _loaded.setdefault(key, getattr(importlib.import_module(module_path), name))
+    return model_class
+
+def micro_mordred(*args, **kwargs):
+    """sirmordred's micro_mordred, imported with grimoire_elk and perceval on the first collection"""
+    from sirmordred.utils.micro import micro_mordred as run_micro_mordred
+    return run_micro_mordred(*args, **kwargs)
@@ -0,0 +1,183 @@
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+
+from urllib.parse import urlparse
+
+import requests
+
+from director import config
+from requests.adapters import HTTPAdapter
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'compass:outbox'
+ENTRIES_KEY = f"{KEY_PREFIX}:entries"
+DUE_KEY = f"{KEY_PREFIX}:due"
+DEAD_KEY = f"{KEY_PREFIX}:dead"
+SCHEDULED_KEY = f"{KEY_PREFIX}:scheduled"
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_HOST_CONCURRENCY = 4
+DEFAULT_MAX_ATTEMPTS = 10
+DEFAULT_MAX_BACKOFF = 3600
+CLAIM_SECONDS = 300
+BATCH_SIZE = 200
+# a scheduled sender still not started this long after its due time is scheduled again
+LOST_SENDER_SECONDS = 60
+
+# take the due entries and hide them from the other senders until they are delivered or rescheduled
+CLAIM_SCRIPT = """
+local ids = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[3])
+for _, id in ipairs(ids) do
+    redis.call('zadd', KEYS[1], ARGV[2], id)
+end
+return ids
+"""
+
+# keep the earliest due time of the scheduled senders, return 1 when the new one is earlier
+# (or when the scheduled one is overdue and considered lost)
+SCHEDULE_SCRIPT = """
+local scheduled = redis.call('get', KEYS[1])
+if scheduled and tonumber(scheduled) <= tonumber(ARGV[1]) and tonumber(scheduled) > tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('set', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+UNSCHEDULE_SCRIPT = """
+local scheduled = redis.call('get', KEYS[1])
+if scheduled and tonumber(scheduled) <= tonumber(ARGV[1]) then
+    redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+def enqueue(hook_url, body, source=None):
+    """Write a callback to the outbox, it is delivered by etl_v1.deliver_callbacks"""
+    entry_id = uuid.uuid4().hex
+    entry = {'hook_url': hook_url, 'body': body, 'source': source, 'attempts': 0, 'created_at': time.time()}
+    pipe = get_redis().pipeline()
+    pipe.hset(ENTRIES_KEY, entry_id, json.dumps(entry, default=str))
+    pipe.zadd(DUE_KEY, {entry_id: time.time()})
+    pipe.execute()
+    return entry_id
+
+def claim(limit=BATCH_SIZE):
+    client = get_redis()
+    now = time.time()
+    ids = client.eval(CLAIM_SCRIPT, 1, DUE_KEY, now, now + CLAIM_SECONDS, limit)
+    if not ids:
+        return []
+    entries = []
+    for entry_id, value in zip(ids, client.hmget(ENTRIES_KEY, ids)):
+        if value is None:
+            client.zrem(DUE_KEY, entry_id)
+            continue
+        entries.append((entry_id.decode('utf-8'), json.loads(value)))
+    return entries
+
+def backoff(attempts):
+    max_backoff = int(config.get('OUTBOX_MAX_BACKOFF') or DEFAULT_MAX_BACKOFF)
+    return min(2 ** attempts * 5, max_backoff) * random.uniform(0.8, 1.2)
+
+def delivered(entry_id):
+    pipe = get_redis().pipeline()
+    pipe.hdel(ENTRIES_KEY, entry_id)
+    pipe.zrem(DUE_KEY, entry_id)
+    pipe.execute()
+
+def failed(entry_id, entry, error):
+    entry['attempts'] += 1
+    entry['error'] = error
+    pipe = get_redis().pipeline()
+    if entry['attempts'] >= int(config.get('OUTBOX_MAX_ATTEMPTS') or DEFAULT_MAX_ATTEMPTS):
+        logger.error(f"Giving up callback {entry_id} to {entry['hook_url']} after {entry['attempts']} attempts: {error}")
+        pipe.hset(DEAD_KEY, entry_id, json.dumps(entry, default=str))
+        pipe.hdel(ENTRIES_KEY, entry_id)
+        pipe.zrem(DUE_KEY, entry_id)
+    else:
+        pipe.hset(ENTRIES_KEY, entry_id, json.dumps(entry, default=str))
+        pipe.zadd(DUE_KEY, {entry_id: time.time() + backoff(entry['attempts'])})
+    pipe.execute()
+
+def next_due():
+    """Return the seconds before the next pending entry is due, None when the outbox is empty"""
+    first = get_redis().zrange(DUE_KEY, 0, 0, withscores=True)
+    return max(0, first[0][1] - time.time()) if first else None
+
+async def deliver(entries):
+    """Post the entries concurrently, at most `OUTBOX_HOST_CONCURRENCY` at once per destination host.
+
+    Each host gets its own pooled session; the blocking posts run in the
+    default executor so a slow hook only holds its own slot for
+    `OUTBOX_TIMEOUT` seconds.
+    """
+    loop = asyncio.get_running_loop()
+    timeout = float(config.get('OUTBOX_TIMEOUT') or DEFAULT_TIMEOUT)
+    host_concurrency = int(config.get('OUTBOX_HOST_CONCURRENCY') or DEFAULT_HOST_CONCURRENCY)
+    sessions = {}
+    semaphores = {}
+
+    def session_for(host):
+        if host not in sessions:
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_maxsize=host_concurrency))
+            session.mount('https://', HTTPAdapter(pool_maxsize=host_concurrency))
+            sessions[host] = session
+            semaphores[host] = asyncio.Semaphore(host_concurrency)
+        return sessions[host], semaphores[host]
+
+    async def post(entry_id, entry):
+        session, semaphore = session_for(urlparse(entry['hook_url']).netloc)
+        async with semaphore:
+            try:
+                resp = await loop.run_in_executor(
+                    None, lambda: session.post(entry['hook_url'], json=entry['body'], timeout=timeout))
+                if resp.status_code >= 500 or resp.status_code == 429:
+                    raise requests.HTTPError(f"{resp.status_code} {resp.text[:200]}")
+            except requests.RequestException as e:
+                failed(entry_id, entry, str(e))
+                return False
+        if resp.status_code >= 400:
+            logger.warning(f"Callback {entry_id} to {entry['hook_url']} rejected: {resp.status_code} {resp.text[:200]}")
+        delivered(entry_id)
+        return True
+
+    try:
+        return await asyncio.gather(*[post(entry_id, entry) for entry_id, entry in entries])
+    finally:
+        for session in sessions.values():
+            session.close()
+
+def drain():
+    """Deliver every due entry of the outbox, return (delivered, failed)"""
+    sent, errors = 0, 0
+    while True:
+        entries = claim()
+        if not entries:
+            return sent, errors
+        results = asyncio.run(deliver(entries))
+        sent += results.count(True)
+        errors += results.count(False)
+
+def schedule_once(countdown):
+    """Return True when no sender is scheduled to run before `countdown` seconds from now.
+
+    The due time of the next scheduled sender is kept in Redis and only
+    moved earlier, so an entry due sooner is never held behind a sender
+    scheduled for a long backoff.
+    """
+    due = time.time() + countdown
+    return bool(get_redis().eval(SCHEDULE_SCRIPT, 1, SCHEDULED_KEY, due, max(1, int(countdown) + CLAIM_SECONDS),
+                                 time.time() - LOST_SENDER_SECONDS))
+
+def scheduled_ran():
+    """Forget the scheduled sender once it is due, the running sender schedules the next one"""
+    get_redis().eval(UNSCHEDULE_SCRIPT, 1, SCHEDULED_KEY, time.time() + 1)
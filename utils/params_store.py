@@ -0,0 +1,47 @@
+import os
+import copy
+import json
+
+from functools import lru_cache
+from os.path import join, exists
+
+PARAMS_DIR = 'params'
+REFS_KEY = 'refs'
+
+
+def put(params, field, value):
+    """Store `field` of a workflow under its configs dir and keep only a reference in `params`.
+
+    Chained tasks pass `params` through the broker and the result backend at
+    every hop, so large or write-only values (the community yaml, the configs
+    of the metrics models) are written once and resolved with `get` by the
+    tasks that need them.
+    """
+    directory = join(params['project_configs_dir'], PARAMS_DIR)
+    if not exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    path = join(directory, f"{field}.json")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f, default=str)
+    os.replace(tmp_path, path)
+    params.pop(field, None)
+    params.setdefault(REFS_KEY, {})[field] = path
+    return params
+
+def get(params, field, default=None):
+    """Return `field` of `params`, inline or loaded from its reference"""
+    if field in params:
+        return params[field]
+    path = params.get(REFS_KEY, {}).get(field)
+    if not path:
+        return default
+    try:
+        return copy.deepcopy(_load(path, os.stat(path).st_mtime_ns))
+    except OSError:
+        raise Exception(f"params field {field} was stored in {path} which can not be read")
+
+@lru_cache(maxsize=64)
+def _load(path, mtime):
+    with open(path, 'r') as f:
+        return json.load(f)
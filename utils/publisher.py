@@ -0,0 +1,81 @@
+import os
+import json
+import threading
+import logging
+
+import pika
+
+logger = logging.getLogger(__name__)
+
+_publishers = {}
+_lock = threading.Lock()
+
+
+class Publisher:
+    """Long-lived AMQP connection and confirmed channel of one worker process.
+
+    pika's BlockingConnection is not thread-safe, so every publish holds the
+    publisher lock. A lost connection is re-opened once before giving up.
+    """
+
+    def __init__(self, url_params):
+        self.url_params = url_params
+        self.connection = None
+        self.channel = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        params = pika.URLParameters(self.url_params)
+        params.socket_timeout = 15
+        self.connection = pika.BlockingConnection(params)
+        self.channel = self.connection.channel()
+        self.channel.confirm_delivery()
+
+    def close(self):
+        try:
+            if self.connection and self.connection.is_open:
+                self.connection.close()
+        except pika.exceptions.AMQPError:
+            pass
+        self.connection = None
+        self.channel = None
+
+    def ensure_connected(self):
+        if not (self.connection and self.connection.is_open and self.channel and self.channel.is_open):
+            self.close()
+            self.connect()
+        # serve heartbeats which were missed while the connection was idle
+        self.connection.process_data_events(time_limit=0)
+
+    def publish(self, messages):
+        """Publish [(queue, message), ...] and wait for the broker confirms.
+
+        After a lost connection, publishing resumes with the first message
+        the broker did not confirm, so the confirmed ones are not sent twice.
+        """
+        messages = list(messages)
+        confirmed = 0
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    self.ensure_connected()
+                    for queue, message in messages[confirmed:]:
+                        # returns once the broker confirmed the message on the confirmed channel
+                        self.channel.basic_publish(exchange='', routing_key=queue, body=json.dumps(message))
+                        confirmed += 1
+                    return
+                except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError):
+                    if attempt:
+                        raise
+                    logger.warning(f"Lost connection to the broker after {confirmed} of {len(messages)} messages, reconnecting")
+                    self.close()
+
+
+def get_publisher(url_params):
+    """Return the publisher of this worker process for `url_params`"""
+    key = (os.getpid(), url_params)
+    publisher = _publishers.get(key)
+    if publisher is None:
+        with _lock:
+            publisher = _publishers.setdefault(key, Publisher(url_params))
+    return publisher
@@ -0,0 +1,236 @@
+import re
+import copy
+import json
+import time
+import zlib
+import fnmatch
+import hashlib
+import threading
+import logging
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import redis
+
+from director import config
+from elasticsearch import Transport
+
+from .redis_client import get_redis
+from .instrumentation import count_query_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 2048
+READ_ENDPOINTS = ('_search', '_count', '_msearch')
+# requests that never change documents, scrolls and clear scrolls included
+NON_WRITE_ENDPOINTS = READ_ENDPOINTS + ('_search/scroll', '_mget', '_mapping', '_settings', '_stats')
+
+KEY_PREFIX = 'compass:esq'
+LRU_KEY = f"{KEY_PREFIX}:lru"
+DEFAULT_REDIS_MAX_ENTRIES = 20000
+DEFAULT_MAX_BYTES = 1024 * 1024
+BULK_INDEX_PATTERN = re.compile(r'"_index"\s*:\s*"([^"]+)"')
+
+
+class QueryMemo:
+    """LRU memo of Elasticsearch read requests → responses"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(method, url, params, body):
+        """Return the memo key of a read request, None for writes and scrolls"""
+        if method not in ('GET', 'POST') or not url.rstrip('/').endswith(READ_ENDPOINTS):
+            return None
+        if params and 'scroll' in params:
+            return None
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        if not isinstance(body, str):
+            body = json.dumps(body, sort_keys=True, default=str)
+        return f"{method} {url} {json.dumps(params or {}, sort_keys=True, default=str)} {body}"
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return copy.deepcopy(self.entries[key][1])
+
+    def put(self, key, response, indexes):
+        with self.lock:
+            self.entries[key] = (indexes, copy.deepcopy(response))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, indexes):
+        """Drop the responses read from `indexes`, every response when the written indexes are unknown.
+
+        Reads through a pattern are dropped when the pattern matches a
+        written index, reads through an alias are not.
+        """
+        with self.lock:
+            stale = [key for key, (read, _) in self.entries.items()
+                     if not indexes or not read or any(fnmatch.fnmatchcase(index, pattern)
+                                                       for index in indexes for pattern in read)]
+            for key in stale:
+                del self.entries[key]
+            self.invalidations += len(stale)
+
+
+@contextmanager
+def memoized_transport(max_entries=None):
+    """Answer identical Elasticsearch reads from memory while the block runs.
+
+    The metrics models create their own clients, so the memo is installed on
+    the Transport class and shared by every client of the process. Celery
+    runs one task at a time per prefork child, the memo only lives for the
+    block, and a write through any client drops the responses read from
+    the written indexes.
+    """
+    memo = QueryMemo(max_entries or int(config.get('FUSED_QUERY_CACHE_ENTRIES') or DEFAULT_MAX_ENTRIES))
+    perform_request = Transport.perform_request
+
+    def memoized_perform_request(self, method, url, headers=None, params=None, body=None):
+        key = memo.key(method, url, params, body)
+        if key is None:
+            if is_write(method, url):
+                memo.invalidate(written_indexes(url, body))
+            return perform_request(self, method, url, headers=headers, params=params, body=body)
+        response = memo.get(key)
+        if response is None:
+            response = perform_request(self, method, url, headers=headers, params=params, body=body)
+            memo.put(key, response, url_indexes(url))
+        return response
+
+    Transport.perform_request = memoized_perform_request
+    try:
+        yield memo
+    finally:
+        Transport.perform_request = perform_request
+        logger.info(f"Elasticsearch query memo: {memo.hits} hits, {memo.misses} misses, "
+                    f"{memo.invalidations} invalidated")
+
+
+def url_indexes(url):
+    """Return the indexes (or patterns) a request targets from its url, [] for cluster wide requests"""
+    first = url.split('?')[0].strip('/').split('/')[0]
+    return [] if not first or first.startswith('_') else sorted(first.split(','))
+
+def is_write(method, url):
+    """Return whether a request may change documents, reads and scrolls never invalidate the cache"""
+    path = url.split('?')[0].rstrip('/')
+    return method not in ('GET', 'HEAD') and not path.endswith(NON_WRITE_ENDPOINTS)
+
+def written_indexes(url, body):
+    indexes = url_indexes(url)
+    if not indexes and url.split('?')[0].rstrip('/').endswith('_bulk') and body:
+        text = body.decode('utf-8', 'ignore') if isinstance(body, bytes) else body
+        if isinstance(text, str):
+            indexes = sorted(set(BULK_INDEX_PATTERN.findall(text)))
+    return indexes
+
+def generation_key(index):
+    return f"{KEY_PREFIX}:gen:{index}"
+
+def invalidate(indexes):
+    """Drop the cached responses of queries on `indexes`, called once their documents changed"""
+    indexes = [index for index in indexes if index]
+    if not indexes or not redis_cache_enabled():
+        return
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for index in indexes:
+            pipe.incr(generation_key(index))
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to invalidate the query cache of {indexes}: {e}")
+
+def redis_cache_enabled():
+    return bool(int(config.get('QUERY_CACHE_TTL') or 0))
+
+def cache_key(client, memo_key, indexes):
+    """Hash of the normalized request and of the generation of every index it reads"""
+    generations = client.mget([generation_key(index) for index in indexes])
+    digest = hashlib.sha256(memo_key.encode('utf-8'))
+    for generation in generations:
+        digest.update(b':' + (generation or b'0'))
+    return f"{KEY_PREFIX}:{indexes[0][:64]}:{digest.hexdigest()}"
+
+def evict(client, max_entries):
+    """Drop the least recently used responses above `max_entries`"""
+    overflow = client.zcard(LRU_KEY) - max_entries
+    if overflow > 0:
+        keys = [key for key, _ in client.zpopmin(LRU_KEY, overflow)]
+        if keys:
+            client.delete(*keys)
+
+def redis_cached(perform_request):
+    """Wrap `Transport.perform_request` with the Redis cache of read requests.
+
+    Reads are keyed by their normalized request and the generation of the
+    indexes they target; scrolls are neither cached nor treated as writes.
+    Any write sent through a Transport of the process, and `invalidate` for
+    the writers that do not use elasticsearch-py (micro_mordred
+    enrichment), bump the generation of the written indexes, so their
+    cached reads are never served again; reads through index
+    patterns or aliases only rely on the ttl. Entries live
+    `QUERY_CACHE_TTL` seconds, responses above `QUERY_CACHE_MAX_BYTES` are
+    not cached and the least recently used entries are evicted above
+    `QUERY_CACHE_MAX_ENTRIES`.
+    """
+    def cached_perform_request(self, method, url, headers=None, params=None, body=None):
+        memo_key = QueryMemo.key(method, url, params, body)
+        indexes = url_indexes(url)
+        if memo_key is None or not indexes:
+            if is_write(method, url):
+                invalidate(written_indexes(url, body))
+            return perform_request(self, method, url, headers=headers, params=params, body=body)
+
+        ttl = int(config.get('QUERY_CACHE_TTL') or 0)
+        try:
+            client = get_redis()
+            key = cache_key(client, memo_key, indexes)
+            cached = client.get(key)
+        except redis.RedisError as e:
+            logger.debug(f"Query cache unavailable: {e}")
+            return perform_request(self, method, url, headers=headers, params=params, body=body)
+        if cached:
+            entry = json.loads(zlib.decompress(cached))
+            count_query_cache('hit', entry['seconds'])
+            try:
+                client.zadd(LRU_KEY, {key: time.time()})
+            except redis.RedisError:
+                pass
+            return entry['response']
+
+        count_query_cache('miss')
+        started = time.monotonic()
+        response = perform_request(self, method, url, headers=headers, params=params, body=body)
+        if isinstance(response, dict):
+            value = zlib.compress(json.dumps({'response': response, 'seconds': time.monotonic() - started}).encode('utf-8'))
+            if len(value) <= int(config.get('QUERY_CACHE_MAX_BYTES') or DEFAULT_MAX_BYTES):
+                try:
+                    client.set(key, value, ex=ttl)
+                    client.zadd(LRU_KEY, {key: time.time()})
+                    evict(client, int(config.get('QUERY_CACHE_MAX_ENTRIES') or DEFAULT_REDIS_MAX_ENTRIES))
+                except redis.RedisError as e:
+                    logger.debug(f"Failed to cache a query response: {e}")
+        return response
+    return cached_perform_request
+
+def install():
+    """Cache the Elasticsearch reads of every client of the process in Redis, with `QUERY_CACHE_TTL` set"""
+    if redis_cache_enabled() and not getattr(Transport.perform_request, 'redis_cached', False):
+        Transport.perform_request = redis_cached(Transport.perform_request)
+        Transport.perform_request.redis_cached = True
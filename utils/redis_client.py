@@ -0,0 +1,23 @@
+import os
+import threading
+
+import redis
+
+from director import config
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_redis():
+    """Return the Redis client of this worker process.
+
+    `REDIS_URI` defaults to the Celery result backend of director.
+    """
+    url = config.get('REDIS_URI') or os.environ.get('DIRECTOR_RESULT_BACKEND_URI') or 'redis://localhost:6379/0'
+    key = (os.getpid(), url)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.setdefault(key, redis.Redis.from_url(url, socket_timeout=15, health_check_interval=30))
+    return client
@@ -0,0 +1,130 @@
+import uuid
+import pickle
+import logging
+
+from datetime import datetime, date
+from decimal import Decimal
+
+from director import config
+from kombu.serialization import register
+
+logger = logging.getLogger(__name__)
+
+try:
+    import msgpack
+    import zstandard
+except ImportError:
+    msgpack = None
+
+CODEC_NAME = 'compass'
+CONTENT_TYPE = 'application/x-compass-msgpack'
+TASK_PREFIXES = ('etl_v1.', 'custom_v1.', 'lab_v1.', 'summary_v1.')
+DEFAULT_COMPRESS_THRESHOLD = 4096
+
+# header of the encoded payloads, followed by one byte telling whether the rest is zstd compressed
+MAGIC = b'CMP1'
+PLAIN = b'\x00'
+ZSTD = b'\x01'
+
+EXT_DATETIME = 1
+EXT_DATE = 2
+
+
+def enabled():
+    return msgpack is not None and config.get('RESULT_CODEC') == CODEC_NAME
+
+def _default(obj):
+    if isinstance(obj, datetime):
+        return msgpack.ExtType(EXT_DATETIME, obj.isoformat().encode('utf-8'))
+    if isinstance(obj, date):
+        return msgpack.ExtType(EXT_DATE, obj.isoformat().encode('utf-8'))
+    if isinstance(obj, (uuid.UUID, Decimal)):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} can not be encoded")
+
+def _ext_hook(code, data):
+    if code == EXT_DATETIME:
+        return datetime.fromisoformat(data.decode('utf-8'))
+    if code == EXT_DATE:
+        return date.fromisoformat(data.decode('utf-8'))
+    return msgpack.ExtType(code, data)
+
+def encode(obj):
+    """msgpack `obj` keeping datetime values, zstd compressed above `RESULT_CODEC_COMPRESS_THRESHOLD` bytes"""
+    packed = msgpack.packb(obj, default=_default, use_bin_type=True)
+    threshold = int(config.get('RESULT_CODEC_COMPRESS_THRESHOLD') or DEFAULT_COMPRESS_THRESHOLD)
+    if len(packed) >= threshold:
+        return MAGIC + ZSTD + zstandard.ZstdCompressor(level=3).compress(packed)
+    return MAGIC + PLAIN + packed
+
+def decode(data):
+    data = bytes(data)
+    if not data.startswith(MAGIC):
+        raise ValueError('Not a compass encoded payload')
+    body = data[len(MAGIC) + 1:]
+    if data[len(MAGIC):len(MAGIC) + 1] == ZSTD:
+        body = zstandard.ZstdDecompressor().decompress(body)
+    return msgpack.unpackb(body, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+
+
+class ResultPickler:
+    """Pickler of the director `tasks.result` column.
+
+    Rows are written with the compass codec when it is enabled, values it can
+    not encode and every row written before keep using pickle.
+    """
+
+    @staticmethod
+    def dumps(obj, protocol=None):
+        if enabled():
+            try:
+                return encode(obj)
+            except (TypeError, ValueError, OverflowError):
+                pass
+        return pickle.dumps(obj, protocol)
+
+    @staticmethod
+    def loads(data):
+        if bytes(data[:len(MAGIC)]) == MAGIC:
+            return decode(data)
+        return pickle.loads(data)
+
+
+class CodecAnnotation:
+    """Send the messages of the scheduler tasks with the compass codec"""
+
+    def annotate(self, task):
+        if task.name.startswith(TASK_PREFIXES):
+            return {'serializer': CODEC_NAME}
+        return None
+
+
+def install(app):
+    """Register the compass codec on the celery `app` and on the director tasks table.
+
+    Decoding is always registered once msgpack and zstandard are installed, so
+    every worker and the director API can read payloads encoded by the others.
+    Encoding starts only with `RESULT_CODEC=compass`, to be set once every
+    process runs this version.
+    """
+    if msgpack is None:
+        if config.get('RESULT_CODEC'):
+            logger.warning('RESULT_CODEC is set but msgpack or zstandard is not installed, keep using json')
+        return
+    register(CODEC_NAME, encode, decode, content_type=CONTENT_TYPE, content_encoding='binary')
+    accept_content = list(app.conf.accept_content or ['json'])
+    result_accept_content = list(app.conf.result_accept_content or accept_content)
+    app.conf.accept_content = accept_content + [CODEC_NAME]
+    app.conf.result_accept_content = result_accept_content + [CODEC_NAME]
+
+    from director.models.tasks import Task
+    Task.__table__.c.result.type.pickler = ResultPickler
+
+    if enabled():
+        annotations = app.conf.task_annotations
+        if annotations is None:
+            annotations = []
+        elif not isinstance(annotations, (list, tuple)):
+            annotations = [annotations]
+        app.conf.task_annotations = list(annotations) + [CodecAnnotation()]
+        app.conf.result_serializer = CODEC_NAME
@@ -0,0 +1,117 @@
+import json
+import logging
+
+from datetime import datetime
+
+import redis
+
+from director import config
+from dateutil import parser
+
+from . import tools, watermarks
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'compass:cost'
+SIZE_CLASSES = ['small', 'medium', 'huge']
+DEFAULT_CLASS_SECONDS = {'small': 900, 'medium': 3 * 3600}
+DEFAULT_RAW_ENRICH_SETUP = ["git", "issue", "issue2", "pull", "pull2", "repo", "stargazer", "fork", "watch", "event"]
+DEFAULT_BACKEND_SECONDS = 20
+DEFAULT_METRIC_SECONDS = 3
+FULL_COLLECTION_FACTOR = 5
+
+
+def run_kind(flags):
+    """Kind of run of a payload or of params: full collection, incremental collection or metrics only.
+
+    Durations are only comparable between runs of the same kind. An
+    incremental run with no watermark to resume from (`full_collection`)
+    collects the full history.
+    """
+    if flags.get('raw') and (flags.get('incremental') == False or flags.get('from-date')
+                             or flags.get('full_collection')):
+        return 'full'
+    if flags.get('raw') or flags.get('enrich'):
+        return 'collect'
+    return 'metrics'
+
+def history_key(project_hash, kind):
+    return f"{KEY_PREFIX}:{project_hash}:{kind}"
+
+def payload_project_hash(payload):
+    url = payload.get('project_template_yaml') or payload.get('project_url')
+    return tools.hash_string(tools.normalize_url(url))
+
+def first_collection(payload, project_yaml=None):
+    """Whether the watermarks of the project do not cover the backends and repos of an incremental payload"""
+    if project_yaml:
+        repos = tools.list_repo_urls(project_yaml['resource_types'])
+    else:
+        repos = [tools.normalize_url(payload['project_url'])]
+    backends = len(payload.get('raw_enrich_setup') or DEFAULT_RAW_ENRICH_SETUP)
+    configs_dir = tools.project_configs_dir(payload_project_hash(payload))
+    return not watermarks.covers(configs_dir, sorted(set(repos)), backends)
+
+def last_duration(project_hash, kind):
+    """Return the seconds the last run of this kind of the project took, None when it never ran"""
+    try:
+        value = get_redis().get(history_key(project_hash, kind))
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read the run history of {project_hash}: {e}")
+        return None
+    return float(value) if value else None
+
+def record_duration(params):
+    """Remember how long the run of the project took from raw to finish, for the next estimates of its kind"""
+    started_at = params.get('raw_started_at')
+    if not started_at:
+        return
+    if isinstance(started_at, str):
+        started_at = parser.parse(started_at)
+    try:
+        get_redis().set(history_key(params['project_hash'], run_kind(params)), (datetime.now() - started_at).total_seconds())
+    except redis.RedisError as e:
+        logger.warning(f"Failed to record the run history of {params['project_hash']}: {e}")
+
+def estimate_cost(payload):
+    """Estimate in seconds the run of an ETL payload.
+
+    The last duration of a run of the same kind (see `run_kind`) of the
+    project is used when it is known, otherwise the cost grows with the
+    number of repositories, of enabled backends and of enabled metrics
+    models. A run without `incremental`, or whose watermarks do not cover
+    its backends and repos yet, collects the full history.
+    """
+    project_yaml = None
+    if payload.get('project_template_yaml'):
+        project_yaml = tools.load_yaml_template(tools.normalize_url(payload['project_template_yaml']))
+    if run_kind(payload) == 'collect' and payload.get('raw') and first_collection(payload, project_yaml):
+        payload = {**payload, 'full_collection': True}
+    history = last_duration(payload_project_hash(payload), run_kind(payload))
+    if history is not None:
+        return history
+    repos = max(tools.count_repos_group(project_yaml)[0], 1) if project_yaml else 1
+    backends = 0
+    if payload.get('raw') or payload.get('enrich'):
+        backends = len(payload.get('raw_enrich_setup') or DEFAULT_RAW_ENRICH_SETUP)
+    if run_kind(payload) == 'full':
+        backends *= FULL_COLLECTION_FACTOR
+    metrics = len([k for k, v in payload.items() if k.startswith('metrics_') and v == True])
+    metrics += 1 if payload.get('custom_metrics') else 0
+    backend_seconds = float(config.get('COST_BACKEND_SECONDS') or DEFAULT_BACKEND_SECONDS)
+    metric_seconds = float(config.get('COST_METRIC_SECONDS') or DEFAULT_METRIC_SECONDS)
+    return repos * (backends * backend_seconds + metrics * metric_seconds)
+
+def size_class(cost):
+    thresholds = json.loads(config.get('COST_CLASS_SECONDS') or 'null') or DEFAULT_CLASS_SECONDS
+    for name in SIZE_CLASSES[:-1]:
+        if cost < thresholds[name]:
+            return name
+    return SIZE_CLASSES[-1]
+
+def route_workflow(payload):
+    """Return the size class workflow (insight.ETL_V1_{CLASS} or insight.ETL_V1_GROUP_{CLASS}) of a payload"""
+    cost = estimate_cost(payload)
+    level = 'GROUP_' if payload.get('project_template_yaml') else ''
+    return f"ETL_V1_{level}{size_class(cost).upper()}", cost
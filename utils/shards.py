@@ -0,0 +1,39 @@
+import os
+import json
+import shutil
+import configparser
+
+from os.path import join, exists
+
+SHARDS_DIR = 'shards'
+
+
+def write_shards(params, phase, shard_size):
+    """Split the repos of a community into batches of `shard_size` for one phase (raw or enrich).
+
+    Each shard gets its own projects file and a copy of the setup.cfg of the
+    project pointing to it, under `{project_configs_dir}/shards/{phase}`.
+    Return the setup.cfg paths of the shards.
+    """
+    with open(params['project_data_path'], 'r') as f:
+        project_data = json.load(f)
+    shards_dir = join(params['project_configs_dir'], SHARDS_DIR, phase)
+    if exists(shards_dir):
+        shutil.rmtree(shards_dir)
+
+    setup = configparser.ConfigParser(allow_no_value=True)
+    setup.read(params['project_setup_path'])
+    keys = sorted(project_data)
+    setup_paths = []
+    for number, start in enumerate(range(0, len(keys), shard_size)):
+        shard_dir = join(shards_dir, f"{number:05d}")
+        os.makedirs(shard_dir)
+        shard_data_path = join(shard_dir, 'project.json')
+        with open(shard_data_path, 'w') as f:
+            json.dump({key: project_data[key] for key in keys[start:start + shard_size]}, f, indent=4, sort_keys=True)
+        setup.set('projects', 'projects_file', shard_data_path)
+        shard_setup_path = join(shard_dir, 'setup.cfg')
+        with open(shard_setup_path, 'w') as cfg:
+            setup.write(cfg)
+        setup_paths.append(shard_setup_path)
+    return setup_paths
@@ -0,0 +1,82 @@
+import logging
+
+from datetime import datetime, timedelta
+
+import redis
+
+from director import config
+from dateutil import parser
+
+from .es_client import get_es_client
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'compass:summary'
+# metric documents are dated by period and stamped when they are (re)computed
+DATE_FIELD = 'grimoire_creation_date'
+UPDATED_FIELD = 'metadata__enriched_on'
+DEFAULT_OVERLAP_DAYS = 7
+
+
+def mark_key(out_index):
+    return f"{KEY_PREFIX}:{out_index}"
+
+def last_summarized(out_index):
+    """Return when the last complete summary into `out_index` started, None when it never ran"""
+    try:
+        value = get_redis().get(mark_key(out_index))
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read the summary mark of {out_index}: {e}")
+        return None
+    return value.decode('utf-8') if value else None
+
+def record(out_index, started_at):
+    """Remember that every metric document stamped before `started_at` (ISO string) is summarized in `out_index`"""
+    try:
+        get_redis().set(mark_key(out_index), started_at)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to record the summary mark of {out_index}: {e}")
+
+def plan(summaries, from_date):
+    """Return the date each summary has to be recomputed from, None when it is up to date.
+
+    `summaries` maps a key to its (metrics index, summary index). One
+    msearch finds, for every summary that ran before, the oldest period of
+    its metrics index with documents computed since then; the summary
+    restarts `SUMMARY_OVERLAP_DAYS` before it, never before `from_date`.
+    Summaries that never ran, or whose index cannot be read, start from
+    `from_date`.
+    """
+    overlap = timedelta(days=int(config.get('SUMMARY_OVERLAP_DAYS') or DEFAULT_OVERLAP_DAYS))
+    dates = {key: from_date for key in summaries}
+    marks = {key: last_summarized(out_index) for key, (_, out_index) in summaries.items()}
+    keys = [key for key, mark in marks.items() if mark]
+    if not keys:
+        return dates
+
+    body = []
+    for key in keys:
+        body.append({'index': summaries[key][0], 'ignore_unavailable': True})
+        body.append({
+            'size': 0,
+            'query': {'range': {UPDATED_FIELD: {'gte': marks[key]}}},
+            'aggs': {'changed_from': {'min': {'field': DATE_FIELD}}}
+        })
+    try:
+        responses = get_es_client().msearch(body=body)['responses']
+    except Exception as e:
+        logger.warning(f"Failed to find the changed metrics periods, summarizing from {from_date}: {e}")
+        return dates
+
+    for key, response in zip(keys, responses):
+        if 'error' in response:
+            logger.warning(f"Failed to find the changed periods of {summaries[key][0]}: {response['error']}")
+            continue
+        changed_from = response['aggregations']['changed_from']['value']
+        if changed_from is None:
+            dates[key] = None
+            continue
+        start = datetime.utcfromtimestamp(changed_from / 1000) - overlap
+        dates[key] = max(start, parser.parse(from_date)).strftime('%Y-%m-%d')
+    return dates
@@ -0,0 +1,188 @@
+import os
+import ast
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import configparser
+
+from collections import Counter
+
+import redis
+import requests
+
+from director import config
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'compass:tokens'
+GITHUB_RATE_LIMIT_URL = 'https://api.github.com/rate_limit'
+POOL_TOKENS = {
+    'github': 'GITHUB_API_TOKEN',
+    'github_graphql': 'GITHUB_GRAPHQL_API_TOKEN',
+    'gitee': 'GITEE_API_TOKEN',
+    'gitcode': 'GITCODE_API_TOKEN'
+}
+DEFAULT_LEASE_SIZE = 2
+DEFAULT_LEASE_SECONDS = 6 * 3600
+DEFAULT_MIN_REMAINING = 100
+QUOTA_TTL = 60
+
+_cfg_lock = threading.Lock()
+
+
+def backend_pool(backend):
+    """Return the token pool of a backend section of setup.cfg, None when it takes no token"""
+    name = backend.split(':')[0]
+    if name.startswith('githubql'):
+        return 'github_graphql'
+    for pool in ['github', 'gitee', 'gitcode']:
+        if name.startswith(pool):
+            return pool
+    return None
+
+def configured_tokens(pool):
+    """Parse the token list of a pool, configured as a list literal or a single token"""
+    value = config.get(POOL_TOKENS[pool])
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    try:
+        tokens = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        tokens = value.split(',')
+    if isinstance(tokens, str):
+        tokens = [tokens]
+    return [token.strip() for token in tokens if token and token.strip()]
+
+def token_id(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()[:16]
+
+def probe_github(pool, token):
+    """Return (remaining, reset_at) of a github token, reading the rate limit costs no quota"""
+    proxies = {'http': config.get('GITHUB_PROXY'), 'https': config.get('GITHUB_PROXY')}
+    resp = requests.get(GITHUB_RATE_LIMIT_URL, headers={'Authorization': f"token {token}"},
+                        proxies=proxies, timeout=10)
+    resp.raise_for_status()
+    resource = resp.json()['resources']['graphql' if pool == 'github_graphql' else 'core']
+    return resource['remaining'], resource['reset']
+
+def refresh_quotas(client, pool, tokens, max_age=QUOTA_TTL):
+    """Probe the tokens of `pool` whose quota is older than `max_age` seconds and return {token_id: (remaining, reset_at)}"""
+    quota_key = f"{KEY_PREFIX}:{pool}:quota"
+    now = time.time()
+    quotas = {}
+    stored = client.hgetall(quota_key)
+    for token in tokens:
+        tid = token_id(token)
+        value = stored.get(tid.encode('utf-8'))
+        remaining, reset_at, checked_at = (float(v) for v in value.decode('utf-8').split(':')) if value else (None, 0, 0)
+        if pool.startswith('github') and now - checked_at >= max_age:
+            try:
+                remaining, reset_at = probe_github(pool, token)
+                client.hset(quota_key, tid, f"{remaining}:{reset_at}:{now}")
+            except (requests.RequestException, KeyError, ValueError) as e:
+                logger.warning(f"Failed to read the rate limit of {pool} token {tid}: {e}")
+        quotas[tid] = (remaining, reset_at)
+    return quotas
+
+def is_exhausted(quota, now):
+    """Whether a (remaining, reset_at) quota is below `TOKEN_MIN_REMAINING` until its reset"""
+    remaining, reset_at = quota
+    min_remaining = int(config.get('TOKEN_MIN_REMAINING') or DEFAULT_MIN_REMAINING)
+    return remaining is not None and remaining < min_remaining and reset_at > now
+
+def lease(pool, size=None, exclude=()):
+    """Lease the healthiest tokens of `pool` for one collection run.
+
+    Tokens with less than `TOKEN_MIN_REMAINING` calls left are skipped until
+    their reset time, the others are ranked by the leases currently held on
+    them by every worker and then by remaining quota. The token ids in
+    `exclude`, drained earlier by the same run, are leased last. Return
+    (lease_id, tokens); when Redis is unreachable or the pool is not larger
+    than the lease, every configured token is returned with no lease.
+    """
+    tokens = configured_tokens(pool)
+    size = size or int(config.get('TOKEN_LEASE_SIZE') or DEFAULT_LEASE_SIZE)
+    if len(tokens) <= size:
+        return None, tokens
+    leases_key = f"{KEY_PREFIX}:{pool}:leases"
+    try:
+        client = get_redis()
+        now = time.time()
+        client.zremrangebyscore(leases_key, '-inf', now)
+        held = Counter(member.decode('utf-8').split(':')[0] for member in client.zrange(leases_key, 0, -1))
+        quotas = refresh_quotas(client, pool, tokens)
+
+        def rank(token):
+            exhausted = token_id(token) in exclude or is_exhausted(quotas[token_id(token)], now)
+            remaining, reset_at = quotas[token_id(token)]
+            return (exhausted, reset_at if exhausted else 0, held[token_id(token)],
+                    -(remaining if remaining is not None else float('inf')))
+
+        leased = sorted(tokens, key=rank)[:size]
+        lease_id = uuid.uuid4().hex
+        expires_at = now + int(config.get('TOKEN_LEASE_SECONDS') or DEFAULT_LEASE_SECONDS)
+        client.zadd(leases_key, {f"{token_id(token)}:{lease_id}": expires_at for token in leased})
+    except redis.RedisError as e:
+        logger.warning(f"Token pool {pool} unavailable, using every token: {e}")
+        return None, tokens
+    return lease_id, leased
+
+def drained(pool, tokens):
+    """Return the ids of `tokens` left without quota, probed again right away"""
+    try:
+        quotas = refresh_quotas(get_redis(), pool, tokens, max_age=0)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read the quotas of the {pool} tokens: {e}")
+        return set()
+    now = time.time()
+    return {tid for tid, quota in quotas.items() if is_exhausted(quota, now)}
+
+def has_spare(pool, exclude):
+    """Whether `pool` holds a token with quota left besides the token ids in `exclude`.
+
+    Only the quota of the github tokens is known, the other pools never
+    report a spare token.
+    """
+    if not pool.startswith('github'):
+        return False
+    tokens = [token for token in configured_tokens(pool) if token_id(token) not in exclude]
+    if not tokens:
+        return False
+    try:
+        quotas = refresh_quotas(get_redis(), pool, tokens)
+    except redis.RedisError:
+        return False
+    now = time.time()
+    return any(not is_exhausted(quota, now) for quota in quotas.values())
+
+def release(pool, lease_id, tokens):
+    if not lease_id:
+        return
+    try:
+        get_redis().zrem(f"{KEY_PREFIX}:{pool}:leases", *[f"{token_id(token)}:{lease_id}" for token in tokens])
+    except redis.RedisError as e:
+        logger.warning(f"Failed to release token lease {lease_id} of {pool}: {e}")
+
+def use_tokens(cfg_path, backend, tokens, sleep_for_rate=True):
+    """Point the `api-token` of a backend section of setup.cfg to the leased tokens.
+
+    Without `sleep_for_rate` the collection stops on a rate limit instead of
+    waiting for the reset, to go on with other tokens of the pool.
+    """
+    with _cfg_lock:
+        setup = configparser.ConfigParser(allow_no_value=True)
+        setup.read(cfg_path)
+        setup.set(backend, 'api-token', json.dumps(tokens))
+        if setup.has_option(backend, 'sleep-for-rate'):
+            setup.set(backend, 'sleep-for-rate', 'true' if sleep_for_rate else 'false')
+        tmp_path = f"{cfg_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as cfg:
+            setup.write(cfg)
+        os.replace(tmp_path, cfg_path)
@@ -6,11 +6,23 @@ import hashlib
 import re
 
 from director import task, config
+from director.extensions import cel
+from celery import current_task
+from director.builder import WorkflowBuilder
+from director.models.workflows import Workflow
+from os.path import abspath, join
 from urllib.parse import urlparse
 from dateutil import parser
 from datetime import datetime, timedelta
+from elasticsearch import NotFoundError
+
+from flask import has_app_context
+
+from .es_client import get_es_client
+from .publisher import get_publisher
+from . import yaml_cache
+from . import params_store
 
-import pika
 import json
 import traceback
 
@@ -18,22 +30,21 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_CONFIG_DIR = 'analysis_data'
+
+director_session = requests.Session()
+
 def basic_publish(queue, message, url_params):
-    params = pika.URLParameters(url_params)
-    params.socket_timeout = 15
-    connection = None
+    basic_publish_many([queue], message, url_params)
+
+def basic_publish_many(queues, message, url_params):
+    """Publish `message` to every queue in one batch over the process-wide broker connection"""
     try:
-        connection = pika.BlockingConnection(params)  # Connect to CloudAMQP
-        channel = connection.channel()
-        channel.basic_publish(exchange='', routing_key=queue,
-                              body=json.dumps(message))
+        get_publisher(url_params).publish([(queue, message) for queue in queues])
     except Exception as e:
         output = traceback.format_exc()
         logger.warning(f"Exception while sending a message to the bot: {output}")
         raise e
-    finally:
-        if connection:
-            connection.close()
 
 def extract_url_info(url):
     uri = urlparse(url)
@@ -71,7 +82,7 @@ def is_governance_type(project_type):
         project_type == 'governance-resources' or \
         project_type == 'governance-projects'
 
-def check_sub_repos_metrics(es_client, out_index, project_types, metrics_payload):
+def list_repo_urls(project_types):
     repo_urls = []
     for (project_type, project_info) in project_types.items():
         suffix = None
@@ -82,43 +93,126 @@ def check_sub_repos_metrics(es_client, out_index, project_types, metrics_payload
         if suffix:
             urls = list(filter(lambda url: url_is_valid(url), project_info['repo_urls']))
             repo_urls.extend(urls)
-    for repo_url in set(repo_urls):
-        last_time = get_last_metrics_model_time(es_client, out_index, repo_url, 'repo')
+    return repo_urls
+
+def project_configs_dir(project_hash):
+    """Directory of the setup, logs and watermarks of an etl_v1 project"""
+    root = config.get('GRIMOIRELAB_CONFIG_FOLDER') or DEFAULT_CONFIG_DIR
+    return abspath(join(root, project_hash[:2], project_hash[2:]))
+
+def project_types(params):
+    """Return the resource types of the community yaml of a workflow"""
+    return params_store.get(params, 'project_yaml')['resource_types']
+
+def project_repo_urls(params):
+    """Return the repos of a workflow, the project url unless it was built from a community yaml"""
+    if params.get('level') == 'repo' or params_store.get(params, 'project_yaml') is None:
+        return [params['project_url']]
+    return list_repo_urls(project_types(params))
+
+def check_sub_repos_metrics(out_index, project_types, metrics_payload):
+    es_client = get_es_client()
+    repo_urls = list_repo_urls(project_types)
+    last_times = get_last_metrics_model_times(es_client, out_index, list(set(repo_urls)), 'repo')
+    expired_urls = []
+    for repo_url, last_time in last_times.items():
         if last_time is None or (last_time is not None and parser.parse(last_time).replace(tzinfo=None) < (datetime.now() - timedelta(days=7))):
             logger.warning(f"Begin to refresh {repo_url} due to expired already {last_time}.")
-            run_single_repo_workflow(repo_url, extra_payload=metrics_payload)
+            expired_urls.append(repo_url)
+    if expired_urls:
+        run_repo_workflows(expired_urls, extra_payload=metrics_payload)
 
-def run_single_repo_workflow(repo_url, extra_payload={}):
-    json_data = {
-        'project': 'insight',
-        'name': 'ETL_V1',
-        'payload': {
-            'debug': False,
-            'enrich': False,
-            'identities_load': False,
-            'identities_merge': False,
-            'force_refresh_enriched': False,
-            'metrics_activity': False,
-            'metrics_codequality': False,
-            'metrics_community': False,
-            'metrics_group_activity': False,
-            'panels': False,
-            'project_url': repo_url,
-            'raw': False,
-        }
+def single_repo_workflow_payload(repo_url, extra_payload={}):
+    payload = {
+        'debug': False,
+        'enrich': False,
+        'identities_load': False,
+        'identities_merge': False,
+        'force_refresh_enriched': False,
+        'metrics_activity': False,
+        'metrics_codequality': False,
+        'metrics_community': False,
+        'metrics_group_activity': False,
+        'panels': False,
+        'project_url': repo_url,
+        'raw': False,
     }
-    json_data['payload'].update(extra_payload)
-    max_retries = 5
-    retry_interval = 15  # seconds
-    for attempt in range(max_retries):
-        response = requests.post(f"{config.get('DEFAULT_HOST')}/api/workflows", json=json_data, verify=False)
-        if response.status_code >= 200 and response.status_code < 300:
-            break
-        else:
-            logger.warning(f"Request failed with status code {response.status_code}. Retrying in {retry_interval} seconds...")
-            time.sleep(retry_interval)
-
-    return response
+    payload.update(extra_payload)
+    return payload
+
+def submit_workflow(project, name, payload):
+    """Create and launch a workflow.
+
+    Inside a worker or the web server (Flask app context available) the workflow
+    is built and enqueued in-process like director's periodic workflows,
+    otherwise it is posted to the director API through a pooled session.
+    """
+    if has_app_context():
+        obj = Workflow(project=project, name=name, payload=payload)
+        obj.save()
+        WorkflowBuilder(obj.id).run()
+        obj.commit()
+        return obj.id
+    response = director_session.post(f"{config.get('DEFAULT_HOST')}/api/workflows",
+                                     json={'project': project, 'name': name, 'payload': payload},
+                                     verify=False, timeout=30)
+    response.raise_for_status()
+    return response.json().get('id')
+
+def submit_queue():
+    """Queue of the submission batches, the queue of the running task by default"""
+    request = current_task.request if current_task else None
+    return config.get('WORKFLOW_SUBMIT_QUEUE') or ((request and request.delivery_info) or {}).get('routing_key')
+
+def submit_repo_batch(repo_urls, extra_payload):
+    """Submit one insight.ETL_V1 workflow per repo right away and return the urls which failed"""
+    failed = []
+    for repo_url in repo_urls:
+        try:
+            submit_workflow('insight', 'ETL_V1', single_repo_workflow_payload(repo_url, extra_payload))
+        except Exception as e:
+            logger.warning(f"Failed to submit workflow of {repo_url}: {e}")
+            failed.append(repo_url)
+    return failed
+
+def retry_repo_batch(failed, extra_payload, attempt, max_retries):
+    """Submit the failed urls again after a short exponential backoff, up to `max_retries` attempts"""
+    if not failed:
+        return
+    if attempt >= max_retries:
+        for repo_url in failed:
+            logger.error(f"Give up submitting workflow of {repo_url} after {max_retries} attempts")
+        return
+    submit_repo_workflows.apply_async(args=(failed, extra_payload), kwargs={'attempt': attempt, 'max_retries': max_retries},
+                                      countdown=min(2 ** (attempt - 1), 10), queue=submit_queue())
+
+@cel.task(name="etl_v1.submit_repo_workflows", acks_late=True)
+def submit_repo_workflows(repo_urls, extra_payload, attempt=0, max_retries=5):
+    """Submit one batch of sub-repo workflows and schedule the failed ones again"""
+    failed = submit_repo_batch(repo_urls, extra_payload)
+    retry_repo_batch(failed, extra_payload, attempt + 1, max_retries)
+    return {'submitted': len(repo_urls) - len(failed), 'failed': len(failed)}
+
+def run_repo_workflows(repo_urls, extra_payload={}, max_retries=5):
+    """Submit one insight.ETL_V1 workflow per repo, at most `WORKFLOW_SUBMIT_RATE` per second.
+
+    The first batch is submitted right away, the next ones are sent as
+    `etl_v1.submit_repo_workflows` tasks one second apart, so the calling
+    task never sleeps. Failed submissions are retried by the same task with
+    a short exponential backoff. Return the urls of the first batch which
+    could not be submitted yet.
+    """
+    rate = max(1, int(float(config.get('WORKFLOW_SUBMIT_RATE') or 20)))
+    repo_urls = list(repo_urls)
+    for countdown, start in enumerate(range(rate, len(repo_urls), rate), 1):
+        submit_repo_workflows.apply_async(args=(repo_urls[start:start + rate], extra_payload),
+                                          kwargs={'max_retries': max_retries}, countdown=countdown, queue=submit_queue())
+    failed = submit_repo_batch(repo_urls[:rate], extra_payload)
+    retry_repo_batch(failed, extra_payload, 1, max_retries)
+    return failed
+
+def run_single_repo_workflow(repo_url, extra_payload={}):
+    return not run_repo_workflows([repo_url], extra_payload=extra_payload)
 
 def get_last_metrics_model_time(es_client, index, label, level):
     try:
@@ -157,6 +251,103 @@ def get_last_metrics_model_query(label, level):
     }
     return query
 
+def get_last_metrics_model_times(es_client, index, labels, level, chunk_size=500):
+    """Batched get_last_metrics_model_time, return {label: last grimoire_creation_date or None}"""
+    last_times = {label: None for label in labels}
+    for i in range(0, len(labels), chunk_size):
+        chunk = labels[i:i + chunk_size]
+        try:
+            buckets = es_client.search(index=index, body=get_last_metrics_model_times_query(chunk, level))["aggregations"]["labels"]["buckets"]
+        except NotFoundError:
+            return last_times
+        for bucket in buckets:
+            hits = bucket["last"]["hits"]["hits"]
+            if bucket["key"] in last_times and hits.__len__() > 0:
+                last_times[bucket["key"]] = hits[0]["_source"]["grimoire_creation_date"]
+    return last_times
+
+def get_last_metrics_model_times_query(labels, level):
+    query = {
+        'size': 0,
+        'query': {
+            'bool': {
+                'must': [
+                    {
+                        'terms': {
+                            'label.keyword': labels
+                        }
+                    },
+                    {
+                        'term': {
+                            'level.keyword': level
+                        }
+                    }
+                ]
+            }
+        },
+        'aggs': {
+            'labels': {
+                'terms': {
+                    'field': 'label.keyword',
+                    'size': len(labels)
+                },
+                'aggs': {
+                    'last': {
+                        'top_hits': {
+                            'size': 1,
+                            '_source': ['grimoire_creation_date'],
+                            'sort': [
+                                {
+                                    'grimoire_creation_date': {
+                                        'order': 'desc',
+                                        'unmapped_type': 'keyword'
+                                    }
+                                }
+                            ]
+                        }
+                    }
+                }
+            }
+        }
+    }
+    return query
+
+def expire_enriched_tags(es_client, index_tags, chunk_size=1024):
+    """Delete the enriched documents of {index: [tag, ...]} with one terms query per index and chunk.
+
+    The deletes run as sliced background tasks on elasticsearch, throttled by
+    `ES_DELETE_REQUESTS_PER_SECOND`. Return their task ids.
+    """
+    requests_per_second = config.get('ES_DELETE_REQUESTS_PER_SECOND') or -1
+    task_ids = []
+    for index, tags in index_tags.items():
+        for i in range(0, len(tags), chunk_size):
+            body = {
+                "query": {
+                    "terms": {
+                        "tag": tags[i:i + chunk_size]
+                    }
+                }
+            }
+            resp = es_client.delete_by_query(index=index, body=body, conflicts='proceed', slices='auto',
+                                             wait_for_completion=False, requests_per_second=requests_per_second)
+            task_ids.append(resp['task'])
+    return task_ids
+
+def pending_es_tasks(es_client, task_ids):
+    """Return the elasticsearch background tasks which are still running"""
+    pending = []
+    for task_id in task_ids:
+        try:
+            resp = es_client.tasks.get(task_id=task_id)
+        except NotFoundError:
+            continue
+        if not resp.get('completed'):
+            pending.append(task_id)
+        elif resp.get('response', {}).get('failures'):
+            logger.warning(f"Elasticsearch task {task_id} finished with failures: {resp['response']['failures']}")
+    return pending
+
 def url_is_valid(url):
     regex = re.compile(
         r'^(?:http|ftp)s?://' # http:// or https://
@@ -201,9 +392,9 @@ def load_yaml_template(url):
     uri = urlparse(url)
     domain_name = tldextract.extract(uri.netloc).domain
     if domain_name in ['gitee', 'gitcode']:
-        return yaml.safe_load(requests.get(url, allow_redirects=True).text)
+        return yaml_cache.load(url)
     else:
-        return yaml.safe_load(requests.get(url, allow_redirects=True, proxies=proxies).text)
+        return yaml_cache.load(url, proxies=proxies)
 
 
 
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import base64
+import threading
+import logging
+
+import requests
+
+from director import config
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_TOKEN_TTL = 1800
+# renew the token this many seconds before it expires
+EXPIRY_MARGIN = 60
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def token_expiry(body, token):
+    """Return when the access token expires, from `expires_in`, the `exp` of a JWT or `TPC_TOKEN_TTL`"""
+    if body.get('expires_in'):
+        return time.time() + float(body['expires_in'])
+    parts = token.split('.')
+    if len(parts) == 3:
+        try:
+            claims = json.loads(base64.urlsafe_b64decode(parts[1] + '=' * (-len(parts[1]) % 4)))
+            if claims.get('exp'):
+                return float(claims['exp'])
+        except (ValueError, TypeError):
+            pass
+    return time.time() + float(config.get('TPC_TOKEN_TTL') or DEFAULT_TOKEN_TTL)
+
+
+class TPCClient:
+    """Client of the TPC service sharing one session and one access token per process"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=4))
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=4))
+        self.timeout = float(config.get('TPC_SERVICE_TIMEOUT') or DEFAULT_TIMEOUT)
+        self.token = None
+        self.expires_at = 0
+        self.lock = threading.Lock()
+
+    def post(self, request_path, payload, token=None):
+        """POST `payload`, return {"status": True, "body": ...} or {"status": False, "message": ...}.
+
+        A request rejected with 401 is sent again once with a new token.
+        """
+        for attempt in range(2):
+            headers = {"Content-Type": "application/json"}
+            if token:
+                headers["Authorization"] = f"Bearer {token}"
+            try:
+                response = self.session.post(f"{self.endpoint}/{request_path}", json=payload,
+                                             headers=headers, timeout=self.timeout)
+                if response.status_code == 401 and token and attempt == 0:
+                    self.invalidate(token)
+                    token = self.access_token()
+                    if token:
+                        continue
+                response.raise_for_status()
+                resp_data = response.json()
+                if "error" in resp_data:
+                    return {"status": False, "message": f"Error: {resp_data.get('description', 'Unknown error')}"}
+                return {"status": True, "body": resp_data}
+            except (requests.RequestException, ValueError) as ex:
+                return {"status": False, "message": str(ex)}
+
+    def access_token(self):
+        """Return the cached access token, authenticating when it is missing or about to expire"""
+        with self.lock:
+            if self.token and time.time() < self.expires_at - EXPIRY_MARGIN:
+                return self.token
+            result = self.post("auth", {
+                "username": config.get('TPC_SERVICE_API_USERNAME'),
+                "password": config.get('TPC_SERVICE_API_PASSWORD')
+            })
+            if not result["status"] or not result["body"].get("access_token"):
+                logger.warning(f"TPC service authentication failed: {result.get('message')}")
+                return None
+            self.token = result["body"]["access_token"]
+            self.expires_at = token_expiry(result["body"], self.token)
+            return self.token
+
+    def invalidate(self, token):
+        with self.lock:
+            if self.token == token:
+                self.token = None
+
+    def opencheck(self, payload):
+        token = self.access_token()
+        if not token:
+            return None
+        return self.post("opencheck", payload, token=token)
+
+
+def get_tpc_client():
+    """Return the TPC client of this worker process"""
+    endpoint = config.get('TPC_SERVICE_API_ENDPOINT')
+    key = (os.getpid(), endpoint)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.setdefault(key, TPCClient(endpoint))
+    return client
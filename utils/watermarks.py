@@ -0,0 +1,83 @@
+import os
+import json
+import threading
+import logging
+
+from os.path import join, exists
+from datetime import datetime, timedelta
+
+from director import config
+
+logger = logging.getLogger(__name__)
+
+WATERMARKS_NAME = 'watermarks.json'
+WATERMARK_FORMAT = '%Y-%m-%d %H:%M:%S'
+DEFAULT_OVERLAP_HOURS = 24
+
+_lock = threading.Lock()
+
+
+def watermarks_path(configs_dir):
+    return join(configs_dir, WATERMARKS_NAME)
+
+def load_watermarks(configs_dir):
+    """Return the {backend: {repo: last successful raw start, in utc}} map of a project"""
+    path = watermarks_path(configs_dir)
+    if not exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        logger.warning(f"Ignoring unreadable watermarks file {path}")
+        return {}
+
+def covers(configs_dir, repos, backends):
+    """Whether at least `backends` backends have a watermark for every repo of `repos`.
+
+    An incremental run finding fewer collects the full history of the
+    others. Only the setup knows the backend names, so they are counted.
+    """
+    covered = [marks for marks in load_watermarks(configs_dir).values()
+               if isinstance(marks, str) or all(repo in marks for repo in repos)]
+    return bool(repos) and len(covered) >= backends
+
+def get_from_date(configs_dir, backend, repos):
+    """Return the `from-date` to collect `backend` of `repos` from, or None for a full collection.
+
+    Watermarks are kept per repo, so a repo added to a community since the
+    last run makes the backend collect the full history again. The oldest
+    watermark of the repos is moved back by `RAW_WATERMARK_OVERLAP_HOURS` so
+    that items updated while the previous collection was running are
+    fetched again.
+    """
+    marks = load_watermarks(configs_dir).get(backend)
+    if not marks or not repos:
+        return None
+    if isinstance(marks, str):
+        # written before the watermarks were kept per repo
+        watermark = marks
+    else:
+        repo_marks = [marks.get(repo) for repo in repos]
+        if None in repo_marks:
+            return None
+        watermark = min(repo_marks)
+    overlap = int(config.get('RAW_WATERMARK_OVERLAP_HOURS') or DEFAULT_OVERLAP_HOURS)
+    from_date = datetime.strptime(watermark, WATERMARK_FORMAT) - timedelta(hours=overlap)
+    return from_date.strftime(WATERMARK_FORMAT)
+
+def advance(configs_dir, backend, started_at, repos):
+    """Record that `backend` of `repos` was fully collected up to `started_at`, a naive utc datetime"""
+    with _lock:
+        watermarks = load_watermarks(configs_dir)
+        watermark = started_at.strftime(WATERMARK_FORMAT)
+        marks = watermarks.get(backend)
+        if not isinstance(marks, dict):
+            marks = {repo: marks for repo in repos} if marks else {}
+        # repos removed from the project are dropped
+        watermarks[backend] = {repo: max(watermark, marks.get(repo) or watermark) for repo in repos}
+        path = watermarks_path(configs_dir)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(watermarks, f, indent=4, sort_keys=True)
+        os.replace(tmp_path, path)
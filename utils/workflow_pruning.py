@@ -0,0 +1,84 @@
+import re
+
+from director import config
+
+# payload flag enabling a group task, when it does not follow {module}.metrics.{name} -> metrics_{name}
+TASK_FLAGS = {
+    'etl_v1.metrics.custom_metrics': 'custom_metrics',
+    'etl_v1.metrics.fused': 'fused_metrics',
+    'summary_v1.sum.fused': 'fused_summary',
+    'summary_v1.sum.activtiy': 'metrics_activity_summary',
+    'summary_v1.sum.community': 'metrics_community_summary',
+    'summary_v1.sum.codequality': 'metrics_codequality_summary',
+    'summary_v1.sum.group_activity_summary': 'metrics_group_activity_summary',
+}
+METRICS_TASK_PATTERN = re.compile(r'^\w+\.metrics\.(\w+)$')
+# payload flag → group tasks run inside a single task once the flag is on, filled by `fuse`
+FUSED_TASKS = {}
+
+
+def task_flag(task_name):
+    """Return the payload flag enabling a task, None for the tasks that always run"""
+    if task_name in TASK_FLAGS:
+        return TASK_FLAGS[task_name]
+    match = METRICS_TASK_PATTERN.match(task_name)
+    return f"metrics_{match.group(1)}" if match else None
+
+def fuse(flag, task_names):
+    """Register the group tasks run by one fused task when the payload sets `flag`"""
+    FUSED_TASKS[flag] = set(task_names)
+
+def is_enabled(task_name, payload):
+    """Whether a group task runs: its flag is set and no enabled fused task runs it already"""
+    flag = task_flag(task_name)
+    if flag and not payload.get(flag):
+        return False
+    return not any(payload.get(fused) and task_name in names for fused, names in FUSED_TASKS.items())
+
+def prune(tasks, payload):
+    """Drop from the groups of a workflow definition the tasks disabled by the payload.
+
+    The tasks a fused task runs are dropped as well once it is enabled.
+    Chained tasks are kept, they prepare or close the run. A group left
+    without any task is removed.
+    """
+    pruned = []
+    for entry in tasks:
+        if isinstance(entry, dict):
+            name = list(entry)[0]
+            group = entry[name]
+            if isinstance(group, dict) and group.get('type') == 'group':
+                enabled = [t for t in group['tasks'] if is_enabled(t, payload)]
+                if not enabled:
+                    continue
+                entry = {name: {**group, 'tasks': enabled}}
+        pruned.append(entry)
+    return pruned
+
+def record_skipped(params):
+    """Record as skipped the disabled metrics, whose tasks were pruned from the workflow"""
+    for flag, enabled in list(params.items()):
+        if flag.startswith('metrics_') and enabled is False:
+            params.setdefault(f"{flag}_finished_at", 'skipped')
+    return params
+
+def enabled():
+    return (config.get('PRUNE_DISABLED_TASKS') or '1') != '0'
+
+def install():
+    """Build the workflows without the group tasks their payload disables, unless `PRUNE_DISABLED_TASKS=0`"""
+    try:
+        from director.builder import WorkflowBuilder
+    except ImportError:
+        return
+    if getattr(WorkflowBuilder.parse, 'pruned', False):
+        return
+    parse = WorkflowBuilder.parse
+
+    def pruned_parse(self, tasks, *args, **kwargs):
+        if enabled():
+            tasks = prune(tasks, self.workflow.payload or {})
+        return parse(self, tasks, *args, **kwargs)
+
+    pruned_parse.pruned = True
+    WorkflowBuilder.parse = pruned_parse
@@ -0,0 +1,105 @@
+import os
+import copy
+import json
+import time
+import hashlib
+import threading
+import logging
+
+from os.path import join, exists
+
+import yaml
+import requests
+
+from director import config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = 'analysis_data'
+DEFAULT_MAX_AGE = 300
+DEFAULT_STALE_SECONDS = 86400
+DEFAULT_TIMEOUT = 10
+
+_entries = {}
+_lock = threading.Lock()
+session = requests.Session()
+
+
+def cache_dir():
+    folder = config.get('YAML_CACHE_FOLDER') or \
+        join(config.get('GRIMOIRELAB_CONFIG_FOLDER') or DEFAULT_CACHE_DIR, 'yaml_cache')
+    if not exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    return folder
+
+def cache_path(url):
+    return join(cache_dir(), f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json")
+
+def read_entry(url):
+    entry = _entries.get(url)
+    if entry:
+        return entry
+    path = cache_path(url)
+    if not exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            entry = json.load(f)
+        entry['data'] = yaml.safe_load(entry['body'])
+    except (OSError, ValueError, yaml.YAMLError):
+        logger.warning(f"Ignoring unreadable yaml cache {path}")
+        return None
+    _entries[url] = entry
+    return entry
+
+def write_entry(url, entry):
+    _entries[url] = entry
+    path = cache_path(url)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({k: v for k, v in entry.items() if k != 'data'}, f)
+    os.replace(tmp_path, path)
+
+def load(url, proxies=None):
+    """Return the parsed yaml at `url`, cached in memory and on disk.
+
+    A copy fetched less than `YAML_CACHE_MAX_AGE` seconds ago is used as is,
+    an older one is revalidated with its ETag / Last-Modified. When the origin
+    fails, a copy younger than `YAML_CACHE_STALE_SECONDS` is served instead.
+    """
+    with _lock:
+        entry = read_entry(url)
+    now = time.time()
+    if entry and now - entry['fetched_at'] < int(config.get('YAML_CACHE_MAX_AGE') or DEFAULT_MAX_AGE):
+        return copy.deepcopy(entry['data'])
+
+    headers = {}
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    try:
+        resp = session.get(url, allow_redirects=True, proxies=proxies, headers=headers,
+                           timeout=int(config.get('YAML_FETCH_TIMEOUT') or DEFAULT_TIMEOUT))
+        if resp.status_code != 304:
+            resp.raise_for_status()
+    except requests.RequestException as e:
+        if entry and now - entry['fetched_at'] < int(config.get('YAML_CACHE_STALE_SECONDS') or DEFAULT_STALE_SECONDS):
+            logger.warning(f"Serving cached {url} since origin failed: {e}")
+            return copy.deepcopy(entry['data'])
+        raise
+
+    if resp.status_code == 304:
+        entry = {**entry, 'fetched_at': now}
+    else:
+        entry = {
+            'url': url,
+            'etag': resp.headers.get('ETag'),
+            'last_modified': resp.headers.get('Last-Modified'),
+            'fetched_at': now,
+            'body': resp.text,
+            'data': yaml.safe_load(resp.text)
+        }
+    with _lock:
+        write_entry(url, entry)
+    return copy.deepcopy(entry['data'])